@@ -95,7 +95,8 @@ class DomBusBinarySensor(BinarySensorEntity):
     def turn_on(self):
         """Set _state to True."""
         self._attr_state = True
-        self.schedule_update_ha_state()
+        self.async_write_ha_state()  # called by the hub in the event loop
+        self._hub.stateWritten()
 
     #        _LOGGER.info("device_state_attributes=%s", self.device_state_attributes)
     #        _LOGGER.info("extra_state_attributes=%s", self.extra_state_attributes)
@@ -103,7 +104,8 @@ class DomBusBinarySensor(BinarySensorEntity):
     def turn_off(self):
         """Set _state to False."""
         self._attr_state = False
-        self.schedule_update_ha_state()
+        self.async_write_ha_state()
+        self._hub.stateWritten()
 
 
 #       _LOGGER.info("Entity=%s", self)
@@ -15,10 +15,16 @@ from homeassistant.const import CONF_DEVICES, CONF_UNIQUE_ID
 # from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import HomeAssistantError
 
-from . import configFileWriteNow, creasol_dombus as dombus, creasol_dombus_const as dbc
+from . import (
+    configFileJournal,
+    creasol_dombus as dombus,
+    creasol_dombus_const as dbc,
+    creasol_dombus_store as store,
+)
 from .const import (
     CONF_BUSNUM,
     CONF_BUSNUMENTRY,
+    CONF_LOGLEVEL,
     CONF_SAVED,
     CONF_SERIALPATH,
     CONF_SERIALPATH_MANUALLY,
@@ -103,6 +109,17 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         )
 
 
+# log levels selectable in the options flow
+LOGLEVEL_OPTIONS = {
+    dbc.LOG_ERR: "Errors",
+    dbc.LOG_WARN: "Warnings",
+    dbc.LOG_INFO: "Info",
+    dbc.LOG_DEBUG: "Debug",
+    dbc.LOG_DUMP: "Debug + dump protocol 2 frames",
+    dbc.LOG_DUMPALL: "Debug + dump all frames",
+}
+
+
 class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
     """Handle Options Flow."""
 
@@ -121,9 +138,18 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
         for bn in self.hass.data[DOMAIN][CONF_SAVED][CONF_BUSNUM]:
             if bn != "next":
                 self.busNums.append(self.hass.data[DOMAIN][CONF_SAVED][CONF_BUSNUM][bn])
+        # show the bus of the config entry the options flow was opened from
+        self.busNum = self.hass.data[DOMAIN][CONF_SAVED][CONF_BUSNUM].get(
+            self.config_entry.entry_id, self.busNum
+        )
         # call the method that ask for bus and devID
         return await self.async_step_devID()
 
+    def busEntryGet(self, busNum):
+        """Return the config entry id of bus busNum, or None."""
+        busNumEntry = self.hass.data[DOMAIN][CONF_SAVED][CONF_BUSNUMENTRY]
+        return busNumEntry.get(busNum) or busNumEntry.get(str(busNum))
+
     async def async_step_devID(self, user_input=None):
         """Manage the DomBus module configuration."""
         errors = {}
@@ -131,8 +157,16 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
             # options sent => check that device exists
             _LOGGER.debug("user_input = %s", str(user_input))
 
+            # log level of the selected bus
+            busEntry = self.busEntryGet(user_input["busNum"])
+            if CONF_LOGLEVEL in user_input and busEntry in self.hass.data[DOMAIN]["hub"]:
+                self.hass.data[DOMAIN]["hub"][busEntry].setLogLevel(
+                    user_input[CONF_LOGLEVEL]
+                )
+
+            if user_input["busNum"] != "":
+                self.busNum = user_input["busNum"]  # the form is shown again with the selected bus
             if user_input["busNum"] != "" and user_input["devID"] != "":
-                self.busNum = user_input["busNum"]
                 self.devID = user_input["devID"]
                 hwaddrport = self.devID.split(".")
                 self.frameAddr = int(hwaddrport[0], 16)
@@ -300,7 +334,7 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
                                     typeName,
                                     setOpt,
                                 )
-                                hub.txQueueAdd(
+                                hub.txQueueAddComplete(
                                     0,
                                     self.frameAddr,
                                     dbc.CMD_CONFIG,
@@ -316,7 +350,7 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
                                     dbc.TX_RETRY,
                                     0,
                                 )  # PORTTYPE_VERSION=1
-                                hub.txQueueAdd(
+                                hub.txQueueAddComplete(
                                     0,
                                     self.frameAddr,
                                     dbc.CMD_CONFIG,
@@ -381,7 +415,7 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
                             if setCal != 32768:  # new calibration value
                                 if setCal < 0:
                                     setCal += 65536
-                                hub.txQueueAdd(
+                                hub.txQueueAddComplete(
                                     0,
                                     self.frameAddr,
                                     dbc.CMD_CONFIG,
@@ -399,7 +433,7 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
 
                             if setHwaddr != 0 and setHwaddr != 0xFFFF:  # hwaddr not 0
                                 # send command to change hwaddr
-                                hub.txQueueAdd(
+                                hub.txQueueAddComplete(
                                     0,
                                     self.frameAddr,
                                     dbc.CMD_CONFIG,
@@ -422,13 +456,20 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
                                     self.busNumEntry
                                 ][self.uniqueID],
                             )
-                            configFileWriteNow(self.hass.data[DOMAIN][CONF_SAVED])
+                            configFileJournal(
+                                self.hass,
+                                store.JOURNAL_SET,
+                                [CONF_DEVICES, self.busNumEntry, self.uniqueID],
+                                device,  # descr and options changed
+                            )
                             _LOGGER.warning("Configuration saved")
                             errors["base"] = "Configuration_saved"
                             self.devID = ""
                             self.cmd = ""
 
-        # prepare options schema
+        # prepare options schema: log level of the bus shown in the form, not of the entry the flow was opened from
+        hub = self.hass.data[DOMAIN]["hub"].get(self.busEntryGet(self.busNum))
+        logLevel = hub.logLevel if hub is not None else dbc.LOG_INFO
         return self.async_show_form(
             step_id="devID",
             data_schema=vol.Schema(
@@ -436,6 +477,9 @@ class DomBusOptionsFlowHandler(config_entries.OptionsFlow):
                     vol.Required("busNum", default=self.busNum): vol.In(self.busNums),
                     vol.Required("devID", default=self.devID): str,
                     vol.Optional("cmd", default=self.cmd): str,
+                    vol.Optional(CONF_LOGLEVEL, default=logLevel): vol.In(
+                        LOGLEVEL_OPTIONS
+                    ),
                 }
             ),
             errors=errors,
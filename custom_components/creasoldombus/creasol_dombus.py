@@ -2,25 +2,43 @@
 
 import asyncio
 import logging
+import re
+from time import monotonic
 
-from . import creasol_dombus_const as dbc
+from . import (
+    creasol_dombus_capture as capture,
+    creasol_dombus_codec as codec,
+    creasol_dombus_const as dbc,
+    creasol_dombus_recorder as recorder,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+# used to jump to the next frame preamble (protocol 1 or 2) with a single search
+RE_PREAMBLE = re.compile(b"[" + re.escape(bytes((dbc.PREAMBLE, dbc.PREAMBLE_DEVICE))) + b"]")
+# remove decoded data from rxbuffer when the read offset exceeds this value
+RXBUFFER_COMPACT = 1024
+
 
 class DomBusProtocol(asyncio.Protocol):
     """Class that manages data exchanged with DomBus modules."""
 
-    def __init__(self, parseFrame):
+    def __init__(self, parseFrame, flightRecorder=None, connectionLost=None):
         """Init the DomBusProtocol object."""
         self.logLevel = (
-            dbc.LOG_DUMPALL  # default log level: will be initialized by onStart()
+            dbc.LOG_INFO  # default log level: set by the hub from the bus options
         )
         self.transport = None
         self.rxbuffer = bytearray()  # serial rx buffer
-        self.rxbufferindex = 0
+        self.rxbufferindex = 0  # read offset inside rxbuffer
         self.txbuffer = bytearray()  # serial tx buffer
         self._parseFrame = parseFrame
+        self._connectionLost = connectionLost  # called with the exception when the connection is lost unexpectedly
+        self.closing = False  # set by close(): connection_lost() is expected
+        self.recorder = flightRecorder  # FlightRecorder that keeps the last frames received and transmitted, or None
+        self.capture = None  # CaptureWriter that saves the raw traffic to file, or None
+        self.rxTime = 0.0  # monotonic time of the last data received: the frame passed to parseFrame() is completed by it
+        self.rxStartTime = 0.0  # monotonic time when the first byte not yet decoded (rxbuffer[rxbufferindex]) was received
 
     def connection_made(self, transport):
         """Call when serial connection is made."""
@@ -29,178 +47,136 @@ class DomBusProtocol(asyncio.Protocol):
 
     def data_received(self, data):
         """Call serial_async when data is received."""
+        now = monotonic()
+        if self.rxbufferindex >= len(self.rxbuffer):
+            self.rxStartTime = now  # nothing pending: the next frame starts with this data
+        self.rxTime = now
+        if self.capture is not None:
+            self.capture.record(capture.CAP_RX, data)
         self.rxbuffer += (
             data  # Simply add new data to the current self.rxbuffer[], and call decode
         )
-        self.decode()
+        self.decode()  # decode all complete frames
 
     def send(self, txbuffer):
         """Just transmits the frame prepared into txbuffer."""
+        if self.transport is None:
+            return  # connection lost: frame discarded, commands are retried by the hub after reconnecting
         self.transport.write(txbuffer)
+        if self.recorder is not None:
+            self.recorder.record(recorder.REC_TX, txbuffer, 0, len(txbuffer), monotonic())
+        if self.capture is not None:
+            self.capture.record(capture.CAP_TX, txbuffer)
         # _LOGGER.debug("TX disabled by send()")
 
     def connection_lost(self, exc):
         """Call when serial connection is lost."""
-        _LOGGER.error("Serial port closed")
-        asyncio.get_event_loop().stop()
-
-    def checksum(self, protocol, buffer):
-        """Compute frame checksum."""
-        self.checksumValue = 0
-        if protocol == 1:
-            length = buffer[dbc.FRAME_LEN] + dbc.FRAME_HEADER
-        else:
-            length = buffer[dbc.FRAME_LEN2] + dbc.FRAME_HEADER2
-        for i in range(0, length):
-            self.checksumValue += buffer[i]
-        self.checksumValue &= 0xFF
-        return self.checksumValue
+        self.transport = None
+        if self.closing:
+            _LOGGER.debug("Serial port closed")
+            return
+        _LOGGER.error("Serial port closed unexpectedly: %s", exc)
+        if self.recorder is not None:
+            self.recorder.trigger("connection lost")
+        if self._connectionLost is not None:
+            self._connectionLost(exc)
+
+    def close(self):
+        """Close the connection: connection_lost() will not report an error or reconnect."""
+        self.closing = True
+        if self.transport is not None:
+            self.transport.close()
+
+    def dumpEnabled(self, protocol):
+        """Return True if frames with this protocol must be written to the log by dump()."""
+        return (
+            self.logLevel >= dbc.LOG_DUMPALL
+            or (self.logLevel >= dbc.LOG_DUMP and protocol != 1)
+        ) and _LOGGER.isEnabledFor(logging.DEBUG)
 
     def dump(self, protocol, buffer, frameLen, direction):
         """Write frame content to the log."""
         # buffer=frame buffer
         # frameLen=length of frame in bytes
         # direction="RX" or "TX"
-        if protocol == 1:
-            f = "P:1 "
-            fl = (
-                frameLen if (frameLen <= len(buffer)) else len(buffer)
-            )  # manage the case that frame is received only partially
-            for i in range(0, fl):
-                f += "%.2x " % int(buffer[i])
-            _LOGGER.debug(direction + " frame: " + f)
-        elif self.logLevel >= dbc.LOG_INFO:
-            f = "P:2 "
-            f += "%.2x " % int(buffer[0])
-            f += "%.4x " % (int(buffer[3]) * 256 + int(buffer[4]))
-            f += "-> "
-            f += "%.4x " % (int(buffer[1]) * 256 + int(buffer[2]))
-            f += "%.2d " % int(buffer[5])  # length
-            i = dbc.FRAME_HEADER2
-            while i < frameLen - 1:
-                # TODO: write SET 01 00 SET 02 01 SET 03 0a SET
-                # TODO: write CFG 02 FF
-                cmd = int(buffer[i]) & dbc.CMD_MASK
-                cmdAck = int(buffer[i]) & dbc.CMD_ACK
-                cmdLen = (int(buffer[i]) & dbc.CMD_LEN_MASK) * 2
-                if cmdLen == 0:
-                    cmdLen = 2  # minimum cmdLen
-                if cmdAck:
-                    f += "A-"
-                if cmd == dbc.CMD_CONFIG:
-                    f += "CFG "
-                    if cmdAck and int(buffer[i + 1] == 0xFF):
-                        # whole port configuration => cmdLen without any sense
-                        cmdLen = (
-                            frameLen - dbc.FRAME_HEADER2 - 2
-                        )  # force cmdLen to the whole frame
-                elif cmd == dbc.CMD_SET:
-                    f += "SET "
-                elif cmd == dbc.CMD_GET:
-                    f += "GET "
-                elif cmd == dbc.CMD_DCMD_CONFIG:
-                    f += "DCMDCFG "
-                elif cmd == dbc.CMD_DCMD:
-                    f += "DCMD "
-                else:
-                    f += "%.2x " % int(buffer[i])
-                i += 1
-
-                for j in range(0, cmdLen):
-                    if (i+j)>=frameLen: break
-                    f += "%.2x " % int(buffer[i + j])
-                f += "| "
-                i += cmdLen
-            f += "%.2x " % int(buffer[i])  # checksum
-            if (
-                cmd == dbc.CMD_DCMD
-            ):  # log DCMD command with priority INFO, so it's possible to monitor traffic between DomBus self.modules
-                _LOGGER.info(direction + " frame: " + f)
-            else:
-                _LOGGER.debug(direction + " frame: " + f)
-        return
-
-    def decode(self):
-        """Decode data from self.rxbuffer."""
-        # align self.rxbuffer[] so it starts with a preamble
-        while len(self.rxbuffer) >= dbc.FRAME_LEN_MIN and (
-            self.rxbuffer[0] != dbc.PREAMBLE_DEVICE and self.rxbuffer[0] != dbc.PREAMBLE
-        ):
-            self.rxbuffer.pop(0)
-        if len(self.rxbuffer) < dbc.FRAME_LEN_MIN:
+        if protocol != 1 and (frameLen <= dbc.FRAME_HEADER2 or self.logLevel < dbc.LOG_INFO):
             return
-        frameError = 1
-        # decode frame RXed from serial port
-        # frame structure was explained above, in the comments
-        if self.rxbuffer[0] == dbc.PREAMBLE_DEVICE:
-            # protocol 1.0 (short version, without sender address)
-            protocol = 1
-            frameLen = int(self.rxbuffer[dbc.FRAME_LEN]) + dbc.FRAME_HEADER + 1
-            # _LOGGER.debug("Rx frame with protocol=%d, frameLen=%d", protocol, frameLen)
-            if frameLen < dbc.FRAME_LEN_MIN:
-                frameError = 4  # invalid frame length
-            elif len(self.rxbuffer) >= frameLen:
-                # length of frame is in the range
-                # compute and compare checksum
-                self.checksum(protocol, self.rxbuffer)
-                if self.logLevel >= dbc.LOG_DUMPALL:
-                    self.dump(protocol, self.rxbuffer, frameLen, "RX")
-                if self.checksumValue == self.rxbuffer[frameLen - 1]:
-                    # frame checksum is ok
-                    frameAddr = int(self.rxbuffer[1]) * 256 + int(self.rxbuffer[2])
-                    frameIdx = dbc.FRAME_HEADER
-                    dstAddr = 0  # Protocol 1 does not have destination address => force dstAddr = 0
-                    frameError = 0
-                else:
-                    frameError = 2  # 2=checksum error
-            else:
-                frameError = 3  # 3=insufficient data
-        elif self.rxbuffer[0] == dbc.PREAMBLE:
-            protocol = 2
-            frameLen = int(self.rxbuffer[dbc.FRAME_LEN2]) + dbc.FRAME_HEADER2 + 1
-            # _LOGGER.debug("Rx frame with protocol=%d, frameLen=%d", protocol, frameLen)
-            if frameLen < dbc.FRAME_LEN_MIN2:
-                frameError = 4  # invalid frame length
-            elif len(self.rxbuffer) >= frameLen:
-                # length of frame is in the range
-                # compute and compare checksum
-                self.checksum(protocol, self.rxbuffer)
-                if self.logLevel >= dbc.LOG_DUMP:
-                    self.dump(protocol, self.rxbuffer, frameLen, "RX")
-                if self.checksumValue == self.rxbuffer[frameLen - 1]:
-                    # frame checksum is ok
-                    frameAddr = int(self.rxbuffer[3]) * 256 + int(
-                        self.rxbuffer[4]
-                    )  # sender
-                    dstAddr = int(self.rxbuffer[1]) * 256 + int(
-                        self.rxbuffer[2]
-                    )  # destination
-                    frameIdx = dbc.FRAME_HEADER2
-                    # broadcast or txQueue exists or txQueue just created
-                    frameError = 0
-                else:
-                    frameError = 2  # 2=checksum error
-            else:
-                frameError = 3  # 3=insufficient data
+        text, cmd = codec.frameText(protocol, buffer, frameLen)
+        if (
+            cmd == dbc.CMD_DCMD
+        ):  # log DCMD command with priority INFO, so it's possible to monitor traffic between DomBus self.modules
+            _LOGGER.info("%s frame: %s", direction, text)
+        else:
+            _LOGGER.debug("%s frame: %s", direction, text)
 
-        if frameError == 0:  # parse frame
-            if frameAddr != 0xFFFF and dstAddr == 0:
-                # Receive command from a slave module
-                self._parseFrame(
-                    protocol, frameAddr, dstAddr, self.rxbuffer[frameIdx : frameLen - 1]
-                )
+    def decode(self):
+        """Decode all complete frames found in self.rxbuffer, starting from self.rxbufferindex."""
+        rxbuffer = self.rxbuffer
+        idx = self.rxbufferindex  # read offset: data before idx was already decoded
+        end = len(rxbuffer)
+        if end - idx >= dbc.FRAME_LEN_MIN:
+            # read-only view used to pass frame payloads to parseFrame without copying them.
+            # rxbuffer cannot be resized while the view exists, so it's released before compacting rxbuffer
+            rxview = memoryview(rxbuffer).toreadonly()
+            try:
+                start = idx
+                idx = self.decodeFrames(rxbuffer, rxview, idx, end)
+                if self.recorder is not None and idx > start:
+                    # all the data decoded by this call is recorded at once, and split into frames only by
+                    # FlightRecorder.snapshot(): nothing is recorded for each frame
+                    self.recorder.record(recorder.REC_RX, rxview, start, idx - start, self.rxTime)
+            finally:
+                rxview.release()
+
+        # compact rxbuffer: cheap when everything was decoded, otherwise only when the decoded part is large
+        if idx >= end:
+            rxbuffer.clear()
+            idx = 0
+        elif idx >= RXBUFFER_COMPACT:
+            del rxbuffer[0:idx]
+            idx = 0
+        self.rxbufferindex = idx
+        return
 
-            # remove current frame from buffer
-            del self.rxbuffer[0:frameLen]
-        else:
-            if frameError != 3:
-                # 3 => insufficient data into rxbuffer: wait for frame completing....
-                # 1, 2 or 4 => erase the first byte of buffer and seek for new preamble
-                # checksum error or frame error
-                if frameError == 2:
+    def decodeFrames(self, rxbuffer, rxview, idx, end):
+        """Extract frames from rxbuffer[idx:end] and return the new read offset."""
+        while end - idx >= dbc.FRAME_LEN_MIN:
+            # decode frame RXed from serial port: frame structure is described in creasol_dombus_codec
+            frameError, protocol, frameLen = codec.checkFrame(rxview, idx, end)
+            if frameError == codec.FRAME_OK or frameError == codec.FRAME_ERR_CHECKSUM:
+                if self.dumpEnabled(protocol):
+                    self.dump(protocol, rxbuffer[idx : idx + frameLen], frameLen, "RX")
+
+            if frameError == codec.FRAME_OK:  # parse frame
+                frameAddr, dstAddr, frameIdx = codec.decodeHeader(protocol, rxbuffer, idx)
+                # move the read offset after the current frame before parsing it
+                frameStart = idx
+                idx += frameLen
+                self.rxbufferindex = idx
+                if frameAddr != 0xFFFF and dstAddr == 0:
+                    # Receive command from a slave module: payload is passed as a memoryview slice,
+                    # valid only while parseFrame() is running
+                    self._parseFrame(
+                        protocol,
+                        frameAddr,
+                        dstAddr,
+                        rxview[frameStart + frameIdx : frameStart + frameLen - 1],
+                    )
+                # bytes after a complete frame are received with the data that completed it
+                self.rxStartTime = self.rxTime
+            elif frameError == codec.FRAME_ERR_INCOMPLETE:
+                # insufficient data into rxbuffer: wait for frame completing....
+                break
+            else:
+                # checksum error, invalid length or missing preamble => seek for the next preamble, skipping the current byte
+                if frameError == codec.FRAME_ERR_CHECKSUM:
                     _LOGGER.debug("Checksum error")
-                else:
+                    if self.recorder is not None:
+                        self.recorder.checksumError()
+                elif frameError != codec.FRAME_ERR_PREAMBLE:
                     _LOGGER.debug("frameError = " + str(frameError))
-                # Erase the first byte of rxbuffer, so the method will look for the next preamble
-                del self.rxbuffer[0]
-        return
+                match = RE_PREAMBLE.search(rxbuffer, idx + 1)
+                idx = match.start() if match else end
+                self.rxbufferindex = idx
+                self.rxStartTime = self.rxTime
+        return idx
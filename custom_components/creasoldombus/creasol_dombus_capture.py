@@ -0,0 +1,263 @@
+"""Capture of raw bus traffic to a compact binary file, and replay transport that feeds a capture to DomBusProtocol.
+
+Capture file format (big-endian):
+    header: MAGIC(4) VERSION(2) BASETIME(double, unix time of the record preceding the first one)
+    records: DELTA(uint32, microseconds since the previous record) DIRECTION(uint8) LENGTH(uint16) DATA[LENGTH]
+
+RX records contain the raw bytes as received by the serial port (also garbage and partial frames),
+TX records contain the frames transmitted. Records are accumulated in memory and appended to the file
+by the executor every CAPTURE_FLUSH_INTERVAL seconds or when CAPTURE_BUFFER_SIZE bytes are pending;
+when the file exceeds CAPTURE_FILE_SIZE it's renamed to filename.1 (filename.1 to filename.2, ...)
+and a new file is started, keeping CAPTURE_FILES old files. A new CaptureWriter rotates the file too,
+if not empty: record times are relative to the BASETIME of the writer that created the file.
+
+This module does not depend on Home Assistant, so it can be used by tools and benchmarks.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time
+
+from . import creasol_dombus_const as dbc
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"DBCP"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct(">4sHd")
+CAPTURE_RECORD = struct.Struct(">IBH")
+CAPTURE_DELTA_MAX = 0xFFFFFFFF  # longer pauses are stored as ~71 minutes
+
+CAP_RX = 0
+CAP_TX = 1
+CAP_NAMES = ("RX", "TX")
+
+
+def captureAppend(
+    filename, data, baseTime, maxSize=dbc.CAPTURE_FILE_SIZE, files=dbc.CAPTURE_FILES, newFile=False
+):
+    """Append records to the capture file, rotating it if too big or if newFile: called in the executor."""
+    try:
+        size = os.path.getsize(filename)
+    except FileNotFoundError:
+        size = 0
+    if size and (newFile or size + len(data) > maxSize):
+        for n in range(files - 1, 0, -1):
+            if os.path.exists(f"{filename}.{n}"):
+                os.replace(f"{filename}.{n}", f"{filename}.{n + 1}")
+        os.replace(filename, f"{filename}.1")
+        size = 0
+    with open(filename, "ab") as fd:
+        if size == 0:
+            fd.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, baseTime))
+        fd.write(data)
+
+
+def captureRead(filename):
+    """Yield (unix time, direction, data) for each record in the capture file."""
+    with open(filename, "rb") as fd:
+        content = fd.read()
+    if len(content) < CAPTURE_HEADER.size:
+        raise ValueError(f"{filename}: not a DomBus capture file")
+    magic, version, t = CAPTURE_HEADER.unpack_from(content, 0)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f"{filename}: not a DomBus capture file")
+    view = memoryview(content)
+    idx = CAPTURE_HEADER.size
+    end = len(content)
+    while idx + CAPTURE_RECORD.size <= end:
+        delta, direction, length = CAPTURE_RECORD.unpack_from(content, idx)
+        idx += CAPTURE_RECORD.size
+        if idx + length > end:
+            break  # last record truncated
+        t += delta / 1000000
+        yield t, direction, view[idx : idx + length]
+        idx += length
+
+
+class CaptureWriter:
+    """Record RX and TX data to a capture file, with buffered writes in the executor and rotation."""
+
+    def __init__(
+        self,
+        filename,
+        executor=None,
+        loop=None,
+        maxSize=dbc.CAPTURE_FILE_SIZE,
+        files=dbc.CAPTURE_FILES,
+    ):
+        """Initialize the writer: records are written by the executor, not by record()."""
+        self.filename = filename
+        self._loop = loop if loop else asyncio.get_event_loop()
+        self._executor = (
+            executor
+            if executor
+            else lambda func, *args: self._loop.run_in_executor(None, func, *args)
+        )
+        self._maxSize = maxSize
+        self._files = files
+        self._buffer = bytearray()  # records not yet written
+        self._bufferBase = time.time()  # unix time of the record preceding the first one in _buffer
+        self._wallStart = self._bufferBase
+        self._monoStart = time.monotonic()
+        self._lastTime = 0  # microseconds since _monoStart of the last record
+        self._handle = None  # TimerHandle of the scheduled write
+        self._task = None  # write in progress
+        self._newFile = True  # first write: start a new file, with the BASETIME of this writer
+        self.records = 0
+        self.bytes = 0  # bytes written to file
+
+    def record(self, direction, data):
+        """Add a record with the current time: data is copied."""
+        now = int((time.monotonic() - self._monoStart) * 1000000)
+        delta = min(now - self._lastTime, CAPTURE_DELTA_MAX)
+        self._lastTime = now
+        self._buffer += CAPTURE_RECORD.pack(delta, direction, len(data))
+        self._buffer += data
+        self.records += 1
+        if len(self._buffer) >= dbc.CAPTURE_BUFFER_SIZE:
+            if self._task is None:
+                self._writeStart()
+        elif self._handle is None and self._task is None:
+            self._handle = self._loop.call_later(dbc.CAPTURE_FLUSH_INTERVAL, self._writeStart)
+
+    def _writeStart(self):
+        """Start the write task."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._task = self._loop.create_task(self._write())
+
+    async def _write(self):
+        """Write task: append the pending records to the file."""
+        try:
+            while self._buffer:
+                data = bytes(self._buffer)
+                baseTime = self._bufferBase
+                self._buffer.clear()
+                self._bufferBase = self._wallStart + self._lastTime / 1000000
+                try:
+                    await self._executor(
+                        captureAppend, self.filename, data, baseTime, self._maxSize, self._files, self._newFile
+                    )
+                    self._newFile = False
+                    self.bytes += len(data)
+                except OSError as e:
+                    _LOGGER.error("Error writing file %s: %s", self.filename, e)
+                    break  # records are lost
+        finally:
+            self._task = None
+
+    async def close(self):
+        """Write the pending records: the writer must not be used anymore."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._task is not None:
+            await self._task
+        if self._buffer:
+            await self._write()
+
+
+class ReplayTransport(asyncio.Transport):
+    """Transport that feeds the RX records of a capture file to a protocol, in place of the serial port.
+
+    speed=1 replays at real time, speed=N at N times the real time, speed=0 as fast as possible.
+    Data written by the protocol is counted and discarded.
+    """
+
+    def __init__(self, loop, protocol, filename, speed=1):
+        """Initialize the transport: replay starts when the protocol is connected."""
+        super().__init__({"filename": filename})
+        self._loop = loop
+        self._protocol = protocol
+        self.filename = filename
+        self.speed = speed
+        self._closing = False
+        self.rxRecords = 0
+        self.rxBytes = 0
+        self.txFrames = 0
+        self.txBytes = 0
+        self.finished = loop.create_future()  # result: replay duration in seconds
+        self._task = None
+
+    def start(self):
+        """Connect the protocol and start the replay task."""
+        self._protocol.connection_made(self)
+        self._task = self._loop.create_task(self._replay())
+
+    async def _replay(self):
+        """Replay task: call protocol.data_received() for each RX record, at the right time."""
+        start = time.monotonic()
+        try:
+            records = await self._loop.run_in_executor(None, lambda: list(captureRead(self.filename)))
+        except (OSError, ValueError) as e:
+            _LOGGER.error("Error reading capture file %s: %s", self.filename, e)
+            records = []
+        t0 = records[0][0] if records else 0
+        for n, (t, direction, data) in enumerate(records):
+            if self._closing:
+                break
+            if direction != CAP_RX:
+                continue
+            if self.speed > 0:
+                delay = start + (t - t0) / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif n % dbc.CAPTURE_REPLAY_BATCH == 0:
+                await asyncio.sleep(0)  # as fast as possible, but let other tasks run
+            self.rxRecords += 1
+            self.rxBytes += len(data)
+            self._protocol.data_received(bytes(data))
+        _LOGGER.info(
+            "Replay of %s completed: %d records, %d bytes", self.filename, self.rxRecords, self.rxBytes
+        )
+        if not self.finished.done():
+            self.finished.set_result(time.monotonic() - start)
+
+    def write(self, data):
+        """Discard data transmitted by the protocol."""
+        self.txFrames += 1
+        self.txBytes += len(data)
+
+    def is_closing(self):
+        """Return True if the transport is closing or closed."""
+        return self._closing
+
+    def close(self):
+        """Stop the replay and disconnect the protocol."""
+        if self._closing:
+            return
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+        if not self.finished.done():
+            self.finished.cancel()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+
+async def createReplayConnection(loop, protocolFactory, filename, speed=1):
+    """Create a ReplayTransport connected to a new protocol: return (transport, protocol), like create_serial_connection()."""
+    protocol = protocolFactory()
+    transport = ReplayTransport(loop, protocol, filename, speed)
+    transport.start()
+    return transport, protocol
+
+
+def parseReplayPath(serialPath):
+    """Return (filename, speed) if serialPath is replay://FILENAME[?speed=N], else None."""
+    if not serialPath.startswith(dbc.REPLAY_PREFIX):
+        return None
+    path = serialPath[len(dbc.REPLAY_PREFIX) :]
+    speed = 1.0
+    path, _, query = path.partition("?")
+    for param in query.split("&"):
+        name, _, value = param.partition("=")
+        if name == "speed":
+            try:
+                speed = float(value)
+            except ValueError:
+                _LOGGER.warning("Invalid replay speed in %s", serialPath)
+    return path, speed
@@ -0,0 +1,279 @@
+"""DomBus frame codec: encode and decode frames exchanged with DomBus modules.
+
+This module does not depend on Home Assistant, so it can be used by tools and benchmarks.
+
+Protocol 1 frame: PREAMBLE_DEVICE|PREAMBLE_MASTER ADDR(16) LENGTH CMD1 PORT1 ARGS1[] ... CHECKSUM
+Protocol 2 frame: PREAMBLE DSTADDR(16) SRCADDR(16) LENGTH CMD1 PORT1 ARGS1[] ... CHECKSUM
+"""
+
+import struct
+from typing import NamedTuple
+
+from . import creasol_dombus_const as dbc
+
+# precompiled header layouts (big-endian)
+HEADER1 = struct.Struct(">BHB")  # preamble, address, payload length
+HEADER2 = struct.Struct(">BHHB")  # preamble, dstAddr, srcAddr, payload length
+
+# port records in the full port configuration (reply to CMD_CONFIG port 0xFF), each one followed by the NUL terminated port name
+PORTCONFIG1 = struct.Struct(">HHHB")  # version 1: portType, portOpt, portCapabilities, portImage
+PORTCONFIG2 = struct.Struct(">IH")  # version 2: portType, portOpt
+PORTNAME_MAX = 16
+
+# frameError values returned by checkFrame()
+FRAME_OK = 0
+FRAME_ERR_CHECKSUM = 2
+FRAME_ERR_INCOMPLETE = 3  # wait for more data
+FRAME_ERR_LENGTH = 4
+FRAME_ERR_PREAMBLE = 5
+
+
+class DomBusCommand(NamedTuple):
+    """Command decoded from a frame payload."""
+
+    cmd: int  # CMD_CONFIG, CMD_GET, CMD_SET, ... (without ACK and length bits)
+    ack: int  # CMD_ACK if this command is an ACK/reply, else 0
+    cmdLen: int  # number of bytes after the cmd byte (port + args)
+    port: int
+    args: memoryview  # bytes after port (cmdLen - 1 bytes)
+
+
+class DomBusFrame(NamedTuple):
+    """Frame decoded by decodeFrame()."""
+
+    protocol: int
+    srcAddr: int
+    dstAddr: int
+    commands: list
+
+
+def checksum(buffer, start, length):
+    """Return the checksum of buffer[start:start+length]: buffer can be bytes, bytearray or memoryview (not copied)."""
+    return sum(memoryview(buffer)[start : start + length]) & 0xFF
+
+
+def checkFrame(buffer, start, end):
+    """Check the frame starting at buffer[start]: return (frameError, protocol, frameLen).
+
+    frameLen includes header and checksum. frameError is FRAME_OK or one of the FRAME_ERR_* values.
+    Pass a memoryview as buffer to verify the checksum without creating a new view for each frame.
+    """
+    if end - start < dbc.FRAME_LEN_MIN:
+        return FRAME_ERR_INCOMPLETE, 0, 0
+    preamble = buffer[start]
+    if preamble == dbc.PREAMBLE_DEVICE:
+        protocol = 1
+        frameLen = buffer[start + dbc.FRAME_LEN] + dbc.FRAME_HEADER + 1
+        frameLenMin = dbc.FRAME_LEN_MIN
+    elif preamble == dbc.PREAMBLE:
+        protocol = 2
+        frameLen = buffer[start + dbc.FRAME_LEN2] + dbc.FRAME_HEADER2 + 1
+        frameLenMin = dbc.FRAME_LEN_MIN2
+    else:
+        return FRAME_ERR_PREAMBLE, 0, 0
+    if frameLen < frameLenMin:
+        return FRAME_ERR_LENGTH, protocol, frameLen
+    if end - start < frameLen:
+        return FRAME_ERR_INCOMPLETE, protocol, frameLen
+    if checksum(buffer, start, frameLen - 1) != buffer[start + frameLen - 1]:
+        return FRAME_ERR_CHECKSUM, protocol, frameLen
+    return FRAME_OK, protocol, frameLen
+
+
+def decodeHeader(protocol, buffer, start=0):
+    """Return (srcAddr, dstAddr, headerLen) of the frame starting at buffer[start]."""
+    if protocol == 1:
+        (_, srcAddr, _) = HEADER1.unpack_from(buffer, start)
+        return srcAddr, 0, dbc.FRAME_HEADER  # protocol 1 does not have destination address
+    (_, dstAddr, srcAddr, _) = HEADER2.unpack_from(buffer, start)
+    return srcAddr, dstAddr, dbc.FRAME_HEADER2
+
+
+def iterCommands(protocol, payload):
+    """Yield a DomBusCommand for each command in the frame payload (frame without header and checksum)."""
+    frameIdx = 0
+    frameLen = len(payload)
+    while frameIdx + 1 < frameLen:
+        cmd = payload[frameIdx]
+        cmdAck = cmd & dbc.CMD_ACK
+        cmdLen = cmd & dbc.CMD_LEN_MASK
+        if protocol != 1:
+            cmdLen *= 2
+        cmd &= dbc.CMD_MASK
+        port = payload[frameIdx + 1]
+        if cmd == dbc.CMD_CONFIG and cmdAck and port == 0xFF:
+            # whole port configuration => cmdLen without any sense: use the rest of the frame
+            cmdLen = frameLen - frameIdx - 1
+        yield DomBusCommand(
+            cmd, cmdAck, cmdLen, port, payload[frameIdx + 2 : frameIdx + cmdLen + 1]
+        )
+        frameIdx += cmdLen + 1
+
+
+def decodeConfigReply(args):
+    """Decode the full port configuration: return a list of (portType, portOpt, portName), starting from port 1.
+
+    args contains the bytes after port 0xFF: VERSION [PORTTYPE PORTOPT ... PORTNAME NUL] [...]
+    """
+    data = bytes(args)  # a single copy, to use bytes.find()
+    portStruct = PORTCONFIG1 if data[:1] == b"\x01" else PORTCONFIG2
+    recordLen = portStruct.size
+    ports = []
+    idx = 1
+    end = len(data) - 1
+    while idx < end and idx + recordLen <= len(data):
+        portType, portOpt = portStruct.unpack_from(data, idx)[:2]
+        idx += recordLen
+        # port name is NUL terminated, max PORTNAME_MAX chars
+        nameEnd = data.find(0, idx, idx + PORTNAME_MAX)
+        if nameEnd < 0:
+            nameEnd = min(idx + PORTNAME_MAX, len(data))
+            nextIdx = nameEnd
+        else:
+            nextIdx = nameEnd + 1
+        ports.append((portType, portOpt, data[idx:nameEnd].decode("latin-1")))
+        idx = nextIdx
+    return ports
+
+
+def decodeFrame(buffer, start=0, end=None):
+    """Decode a complete frame: return (frameError, frameLen, DomBusFrame or None)."""
+    if end is None:
+        end = len(buffer)
+    frameError, protocol, frameLen = checkFrame(buffer, start, end)
+    if frameError != FRAME_OK:
+        return frameError, frameLen, None
+    srcAddr, dstAddr, headerLen = decodeHeader(protocol, buffer, start)
+    payload = memoryview(buffer)[start + headerLen : start + frameLen - 1]
+    return (
+        FRAME_OK,
+        frameLen,
+        DomBusFrame(protocol, srcAddr, dstAddr, list(iterCommands(protocol, payload))),
+    )
+
+
+# command names used by frameText(), indexed by cmd|cmdAck
+CMD_NAMES = {}
+for _cmd, _name in (
+    (dbc.CMD_CONFIG, "CFG"),
+    (dbc.CMD_GET, "GET"),
+    (dbc.CMD_SET, "SET"),
+    (dbc.CMD_DCMD_CONFIG, "DCMDCFG"),
+    (dbc.CMD_DCMD, "DCMD"),
+):
+    CMD_NAMES[_cmd] = _name
+    CMD_NAMES[_cmd | dbc.CMD_ACK] = "A-" + _name
+
+
+def frameText(protocol, buffer, frameLen):
+    """Return (text, cmd): frame in readable form, used by logs and by the flight recorder, and the last command.
+
+    Frames received only partially (len(buffer) < frameLen) are formatted up to the last byte available.
+    """
+    frameLen = min(frameLen, len(buffer))
+    if protocol == 1 or frameLen <= dbc.FRAME_HEADER2:
+        return f"P:{protocol} {bytes(buffer[0:frameLen]).hex(' ')}", 0
+    # P:2 PREAMBLE SRCADDR -> DSTADDR LEN | SET 01 00 | A-CFG ff ... | CHECKSUM
+    f = [
+        f"P:2 {buffer[0]:02x} {buffer[3]:02x}{buffer[4]:02x} -> {buffer[1]:02x}{buffer[2]:02x} {buffer[5]:02d}"
+    ]
+    cmd = 0
+    i = dbc.FRAME_HEADER2
+    while i < frameLen - 1:
+        cmd = buffer[i] & dbc.CMD_MASK
+        cmdAck = buffer[i] & dbc.CMD_ACK
+        cmdLen = (buffer[i] & dbc.CMD_LEN_MASK) * 2
+        if cmdLen == 0:
+            cmdLen = 2  # minimum cmdLen
+        if cmd == dbc.CMD_CONFIG and cmdAck and i + 1 < frameLen and buffer[i + 1] == 0xFF:
+            # whole port configuration => cmdLen without any sense
+            cmdLen = frameLen - i - 2  # force cmdLen to the whole frame
+        name = CMD_NAMES.get(cmd | cmdAck)
+        if name is None:
+            name = f"{buffer[i]:02x}"
+        i += 1
+        f.append(f"{name} {bytes(buffer[i : min(i + cmdLen, frameLen)]).hex(' ')}")
+        i += cmdLen
+    f.append(f"{buffer[frameLen - 1]:02x}")  # checksum
+    return " | ".join(f), cmd
+
+
+CMDPORT = struct.Struct(">BB")  # command byte, port
+FRAME_BUFFER_SIZE = dbc.FRAME_HEADER2 + 256  # max frame length: header, 255 bytes payload, checksum
+
+
+class FrameEncoder:
+    """Encode frames into a reusable buffer, computing the checksum while commands are added.
+
+    begin() starts a new frame, add() appends commands, finish() returns the frame as a bytes object.
+    Header bytes of each destination address are computed once and cached.
+    """
+
+    def __init__(self):
+        """Initialize the encoder buffer and the header cache."""
+        self.buffer = bytearray(FRAME_BUFFER_SIZE)
+        self.length = 0  # number of bytes in buffer
+        self.protocol = 2
+        self._checksum = 0  # sum of bytes in buffer, without the length byte
+        self._headers = {}  # _headers[(protocol, dstAddr, srcAddr)]=(header bytes, sum of header bytes)
+
+    def begin(self, protocol, dstAddr, srcAddr=0):
+        """Start a new frame: protocol=1, or 2 (also used for protocol=0, unknown)."""
+        key = (protocol, dstAddr, srcAddr)
+        header = self._headers.get(key)
+        if header is None:
+            if protocol == 1:
+                data = HEADER1.pack(dbc.PREAMBLE_MASTER, dstAddr, 0)
+            else:
+                data = HEADER2.pack(dbc.PREAMBLE, dstAddr, srcAddr, 0)
+            header = self._headers[key] = (data, sum(data))
+        (data, self._checksum) = header
+        self.length = len(data)
+        self.buffer[0 : self.length] = data
+        self.protocol = protocol
+
+    def add(self, cmd, cmdLen, cmdAck, port, args):
+        """Append a command. cmdLen=length of data after command (port+args[])."""
+        buffer = self.buffer
+        idx = self.length
+        if self.protocol == 1:
+            cmdByte = cmd | cmdLen | cmdAck
+        else:
+            # cmdLen field is the number of cmd payload/2, so if after cmd there are 3 or 4 bytes, cmdLen field must be 2 (corresponding to 4 bytes)
+            cmdByte = cmd | cmdAck | ((cmdLen + 1) >> 1)
+        CMDPORT.pack_into(buffer, idx, cmdByte, port)
+        checksum = self._checksum + cmdByte + port
+        idx += 2
+        for i in range(0, cmdLen - 1):
+            value = args[i] & 0xFF
+            buffer[idx] = value
+            checksum += value
+            idx += 1
+        if self.protocol != 1 and (cmdLen & 1):
+            # cmdLen is odd => add a dummy byte to get even cmdLen
+            buffer[idx] = 0
+            idx += 1
+        self._checksum = checksum
+        self.length = idx
+
+    def finish(self):
+        """Set payload length and checksum: return the frame as bytes."""
+        buffer = self.buffer
+        if self.protocol == 1:
+            payloadLen = self.length - dbc.FRAME_HEADER
+            buffer[dbc.FRAME_LEN] = payloadLen
+        else:
+            payloadLen = self.length - dbc.FRAME_HEADER2
+            buffer[dbc.FRAME_LEN2] = payloadLen
+        buffer[self.length] = (self._checksum + payloadLen) & 0xFF
+        self.length += 1
+        return bytes(memoryview(buffer)[0 : self.length])
+
+
+def encodeFrame(protocol, dstAddr, commands, srcAddr=0):
+    """Return a complete frame with commands, a list of (cmd, cmdLen, cmdAck, port, args)."""
+    encoder = FrameEncoder()
+    encoder.begin(protocol, dstAddr, srcAddr)
+    for cmd, cmdLen, cmdAck, port, args in commands:
+        encoder.add(cmd, cmdLen, cmdAck, port, args)
+    return encoder.finish()
@@ -8,7 +8,10 @@ PROTOCOL1_WITH_PERIODIC_TX = 0  # set to 1 if all existing modules transmit thei
 # Set to True to get this the only one controller on the bus
 TXACK_ENABLE = False
 
+CONFIGFILE = "creasoldombus.json"  # in Home Assistant config dir
 PORTSDISABLEDFILE = "creasoldombus_%d_portsDisabled.json"
+RECORDERFILE = "creasoldombus_%d_recorder_%s.log"  # flight recorder dump: bus number, date/time
+CAPTUREFILE = "creasoldombus_%d_capture.bin"  # binary capture of the bus traffic, see creasol_dombus_capture
 PORTS_MAX = 32
 
 # some constants
@@ -30,6 +33,8 @@ TX_RETRY = 10  # max number of retries
 TX_RETRY_TIME = 80  # ms: retry every TX_RETRY_TIME * 2^retry
 # seconds: refresh output status to device every 5 minutes
 PERIODIC_STATUS_INTERVAL = 300
+# ms: min time between two periodic output status frames on the bus (300 modules are refreshed in 30 seconds)
+STATUS_TX_INTERVAL = 100
 
 # if no frame is received in this time, module is considered dead (and periodic output status will not be transmitted)
 MODULE_ALIVE_TIME = 900
@@ -206,23 +211,38 @@ DCMD_OUT_CMDS = {
 
 frameLen = 0
 
-LASTRX = 0  # first field in modules[]
-LASTTX = 1  # second field in modules[]
-LASTSTATUS = 2  # third field in modules[]
-LASTPROTOCOL = 3  # forth field in modules[]
-LASTRETRY = (
-    4  # fifth field in modules[]: number of retries (used to compute the tx period)
-)
-LASTCONFIG = (
-    5  # used to limit the configuration request to modules partially configured
-)
-
-TXQ_CMD = 0
-TXQ_CMDLEN = 1
-TXQ_CMDACK = 2
-TXQ_PORT = 3
-TXQ_ARGS = 4
-TXQ_RETRIES = 5
+TX_DUE_NEVER = 1 << 62  # ModuleState.nextDue value for modules not in the tx scheduler heap
+
+# flight recorder: last frames exchanged on the bus, see creasol_dombus_recorder
+# Recording costs ~1us for each decode() call (usually one for each frame received) and for each frame
+# transmitted, negligible with hundreds of frames per minute: always started with the bus, so that a trace
+# is available when something goes wrong. Services recorder_stop and recorder_start switch it at runtime
+RECORDER_ENABLE = True
+RECORDER_SIZE = 65536  # bytes of frame data kept in memory
+RECORDER_RECORDS = 4096  # max number of records (frames transmitted, data received by decode()) kept in memory
+RECORDER_BURST_ERRORS = 5  # checksum errors within RECORDER_BURST_TIME seconds that write the recorder to file
+RECORDER_BURST_TIME = 2
+RECORDER_TRIGGER_INTERVAL = 300  # seconds: min time between automatic writes of the recorder
+
+# capture of the bus traffic to file, and replay, see creasol_dombus_capture
+CAPTURE_BUFFER_SIZE = 65536  # bytes of records kept in memory before writing them to file
+CAPTURE_FLUSH_INTERVAL = 5  # seconds: max time before records are written to file
+CAPTURE_FILE_SIZE = 16 * 1024 * 1024  # bytes: a bigger capture file is renamed to filename.1 and a new one is started
+CAPTURE_FILES = 5  # number of rotated capture files kept (filename.1 ... filename.5)
+CAPTURE_REPLAY_BATCH = 64  # replay as fast as possible: records fed to the protocol before yielding to the event loop
+REPLAY_PREFIX = "replay://"  # serial path replay://FILENAME[?speed=N] replays a capture file (speed=0: as fast as possible)
+
+# latency histograms, see creasol_dombus_latency
+LATENCY_MIN = 0.000001  # seconds: upper bound of the first bucket
+LATENCY_BUCKETS_PER_OCTAVE = 4  # bucket upper bounds grow by 2^(1/4), so percentiles are within 19%
+LATENCY_BUCKETS = 100  # buckets from LATENCY_MIN to ~33 seconds; the last bucket also counts longer times
+CMDSTATS_MODULES = 512  # max modules in the command statistics table: the oldest module is removed
+CMDSTATS_RECENT = 8  # last completed command traces kept for each module
+
+PORT_ENTITY = 0  # first field in port table slot: entity
+PORT_DISABLED = 1  # second field in port table slot: 1 if port is disabled
+PORT_HANDLERS = 2  # third field in port table slot: dict {cmd|cmdAck: handler}
+PORT_PLATFORM = 3  # fourth field in port table slot: platform of the entity ("switch", "light", ...)
 
 LOG_NONE = 0
 LOG_ERR = 1
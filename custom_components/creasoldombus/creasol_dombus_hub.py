@@ -0,0 +1,1275 @@
+"""DomBus hub core: frame parsing, tx queues, module tracking, discovery and value decoding.
+
+This module does not depend on Home Assistant: entities are created and updated through an
+EntitySink. The Home Assistant integration (DomBusHub in __init__.py) is a thin adapter on top of
+DomBusHubCore; MemorySink keeps entities in memory, to run the hub from a plain asyncio script
+(benchmarks, simulators, or the bus logic in a separate process):
+
+    hub = DomBusHubCore(1, MemorySink(), serialPath="/dev/ttyUSB0")
+    hub.rxEnabled = True
+    hub.connect()
+
+Entities created by the sink must provide the attributes and methods used by the rxSet*() handlers
+and by txOutputsStatus(): porttype, is_on, turn_on(), turn_off(), brightness (lights), setstate(),
+_attr_state, unit_of_measurement, device_class, last_pulses and power (sensors).
+"""
+
+import asyncio
+import collections
+import functools
+import heapq
+import logging
+import os
+import time
+from time import monotonic
+
+from . import (
+    creasol_dombus as dombus,
+    creasol_dombus_capture as capture,
+    creasol_dombus_codec as codec,
+    creasol_dombus_const as dbc,
+    creasol_dombus_latency as latency,
+    creasol_dombus_recorder as recorder,
+    creasol_dombus_store as store,
+)
+from .const import CONF_BUSNUM, CONF_BUSNUMENTRY, CONF_SAVED, HEARTBEAT_INTERVAL
+from .creasol_dombus_state import ModuleState, TxCommand
+
+_LOGGER = logging.getLogger(__name__)
+
+# config keys, device classes and units of measurement: same values used by Home Assistant
+CONF_DEVICES = "devices"
+CONF_ENTITIES = "entities"
+DEVICE_CLASS_ENERGY = "energy"
+DEVICE_CLASS_HUMIDITY = "humidity"
+DEVICE_CLASS_TEMPERATURE = "temperature"
+ENERGY_KILO_WATT_HOUR = "kWh"
+PERCENTAGE = "%"
+TEMP_CELSIUS = "°C"
+
+# PORTTYPE_ENTITY[porttype]=(platform, descr, default options): used to create the entity for a port reported by the module configuration
+PORTTYPE_ENTITY = {
+    dbc.PORTTYPE_OUT_DIGITAL: ("switch", "OUT_DIGITAL", {}),
+    dbc.PORTTYPE_OUT_RELAY_LP: ("switch", "OUT_RELAY_LP", {}),
+    dbc.PORTTYPE_OUT_LEDSTATUS: ("switch", "OUT_LEDSTATUS", {}),
+    dbc.PORTTYPE_OUT_BUZZER: ("switch", "OUT_BUZZER", {}),
+    dbc.PORTTYPE_OUT_DIMMER: ("light", "OUT_DIMMER", {}),
+    dbc.PORTTYPE_OUT_ANALOG: ("light", "OUT_ANALOG", {}),
+    dbc.PORTTYPE_IN_AC: ("binary_sensor", "IN_AC", {}),
+    dbc.PORTTYPE_IN_DIGITAL: ("binary_sensor", "IN_DIGITAL", {}),
+    dbc.PORTTYPE_IN_ANALOG: ("sensor", "IN_ANALOG", {"value": 0}),
+    dbc.PORTTYPE_IN_TWINBUTTON: ("sensor", "IN_TWINBUTTON", {"value": 0}),
+    dbc.PORTTYPE_IN_COUNTER: (
+        "sensor",
+        "IN_COUNTER",
+        {
+            "value": 0,
+            "entityClass": DEVICE_CLASS_ENERGY,
+            "entityUOM": ENERGY_KILO_WATT_HOUR,
+        },
+    ),
+    dbc.PORTTYPE_SENSOR_DISTANCE: ("sensor", "DISTANCE", {"value": 0}),
+    dbc.PORTTYPE_SENSOR_TEMP: (
+        "sensor",
+        "TEMPERATURE",
+        {
+            "value": 25,  # dummy temperature
+            "entityClass": DEVICE_CLASS_TEMPERATURE,
+            "entityUOM": TEMP_CELSIUS,
+        },
+    ),
+    dbc.PORTTYPE_SENSOR_HUM: (
+        "sensor",
+        "HUMIDITY",
+        {
+            "value": 50,  # dummy humidity
+            "entityClass": DEVICE_CLASS_HUMIDITY,
+            "entityUOM": PERCENTAGE,
+        },
+    ),
+    dbc.PORTTYPE_SENSOR_TEMP_HUM: (
+        "sensor",
+        "TEMP+HUM",
+        {
+            "value": 25,  # dummy temperature
+            "entityClass": DEVICE_CLASS_TEMPERATURE,
+            "entityUOM": TEMP_CELSIUS,
+        },
+    ),
+}
+
+# RX_DISPATCH[(cmd, cmdAck, porttype)]=DomBusHub method that handles the command received from an entity with that porttype
+RX_DISPATCH = {
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_OUT_DIGITAL): "rxSetDigital",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_OUT_RELAY_LP): "rxSetDigital",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_OUT_BUZZER): "rxSetDigital",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_IN_DIGITAL): "rxSetDigital",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_IN_AC): "rxSetDigital",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_IN_COUNTER): "rxSetCounter",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_SENSOR_TEMP): "rxSetTemperature",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_SENSOR_TEMP_HUM): "rxSetTemperature",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_SENSOR_HUM): "rxSetHumidity",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_IN_ANALOG): "rxSetAnalog",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_SENSOR_DISTANCE): "rxSetAnalog",
+    (dbc.CMD_SET, 0, dbc.PORTTYPE_IN_TWINBUTTON): "rxSetTwinButton",
+}
+
+
+class EntitySink:
+    """Interface used by DomBusHubCore to create entities, add them to the frontend and save their configuration."""
+
+    def createEntity(self, hub, entityConfig):
+        """Return a new entity for entityConfig=[uniqueID, portList, name, porttypeList, opts], or None if not supported."""
+        raise NotImplementedError
+
+    def addEntities(self, entities):
+        """Add a list of new entities, created by createEntity()."""
+        raise NotImplementedError
+
+    def saveEntityConfig(self, uniqueID, entityConfig):
+        """Save the new or changed entity configuration, already stored in hub.devices[uniqueID]."""
+
+
+class MemoryEntity:
+    """Entity kept in memory by MemorySink: same interface used by the hub for the Home Assistant entities."""
+
+    def __init__(self, hub, unique_id, port_list, name=None, porttype_list=None, opts_dict=None):
+        """Initialize the entity from its configuration."""
+        self._hub = hub
+        self.unique_id = unique_id
+        (
+            self._busnum,
+            self._protocol,
+            self._frameAddr,
+            self._port,
+            self._devID,
+            self.platform,
+        ) = port_list
+        self.name = name
+        (self.porttype, self._portopt, self._descr) = porttype_list
+        opts = opts_dict or {}
+        self._attr_state = opts.get("value")
+        self.device_class = opts.get("entityClass")
+        self.unit_of_measurement = opts.get("entityUOM")
+        self.is_on = False
+        self.brightness = 0
+        self.last_pulses = 0
+        self.power = 0
+        self.writes = 0  # number of state changes
+
+    @property
+    def state(self):
+        """Return the state of the entity."""
+        return self.is_on if self._attr_state is None else self._attr_state
+
+    def stateWritten(self):
+        """Count a state change (in Home Assistant: async_write_ha_state())."""
+        self.writes += 1
+        self._hub.sink.writes += 1
+        self._hub.stateWritten()
+
+    def turn_on(self):
+        """Set the state to on: outputs also transmit the command to the module, like DomBusSwitch."""
+        self.is_on = True
+        self.brightness = 255
+        self.stateWritten()
+        if self.platform != "binary_sensor":
+            self._hub.txQueueAddComplete(
+                0, self._frameAddr, dbc.CMD_SET, 2, 0, self._port, (1,), dbc.TX_RETRY, 1
+            )
+            self._hub.send()
+
+    def turn_off(self):
+        """Set the state to off: outputs also transmit the command to the module, like DomBusSwitch."""
+        self.is_on = False
+        self.stateWritten()
+        if self.platform != "binary_sensor":
+            self._hub.txQueueAddComplete(
+                0, self._frameAddr, dbc.CMD_SET, 2, 0, self._port, (0,), dbc.TX_RETRY, 1
+            )
+            self._hub.send()
+
+    def setstate(self, value):
+        """Update the state of a sensor, if changed."""
+        if value != self._attr_state:
+            self._attr_state = value
+            self.stateWritten()
+
+
+class MemorySink(EntitySink):
+    """Entity sink that keeps entities and their configuration in memory, to run the hub without Home Assistant."""
+
+    def __init__(self):
+        """Initialize the sink."""
+        self.entities = {}  # entities[uniqueID]=MemoryEntity
+        self.saved = 0  # number of entity configurations saved
+        self.writes = 0  # number of entity state changes
+
+    def createEntity(self, hub, entityConfig):
+        """Return a new MemoryEntity."""
+        return MemoryEntity(hub, *entityConfig)
+
+    def addEntities(self, entities):
+        """Add entities to the sink."""
+        for entity in entities:
+            self.entities[entity.unique_id] = entity
+
+    def saveEntityConfig(self, uniqueID, entityConfig):
+        """Count the saved configurations: nothing is written."""
+        self.saved += 1
+
+
+class DomBusHubCore:
+    """DomBus bus: frame parsing, tx queues, module tracking and discovery, without Home Assistant."""
+
+    def __init__(
+        self,
+        busNum,
+        sink,
+        devices=None,
+        entities=None,
+        serialPath=None,
+        logLevel=dbc.LOG_INFO,
+        loop=None,
+        executor=None,
+        configDir=".",
+    ):
+        """Initialize the hub.
+
+        devices[uniqueID]=entityConfig: saved configuration of the bus entities, updated by registerEntities().
+        entities[uniqueID]=entity: entities created by the sink.
+        executor(func, *args) runs blocking file operations (default: loop.run_in_executor).
+        configDir: directory for disabled ports, flight recorder and capture files.
+        """
+        self.txAckEnabled = (
+            dbc.TXACK_ENABLE
+        )  # DEBUG: if False, does not transmit ACKs. Used when another controller is connected to the same bus
+        self.rxEnabled = False
+        self.logLevel = logLevel  # LOG_DUMP or LOG_DUMPALL to write frames to the log (at debug level)
+        self.sink = sink
+        self.devices = devices if devices is not None else {}
+        self.entities = entities if entities is not None else {}
+        self._ports = {}  # _ports[frameAddr]=[[entity, disabled, rxHandlers, platform], ...] indexed by port, see portTable()
+        self._busNum = busNum
+        self._serialpath = serialPath
+        self.loop = loop if loop else asyncio.get_event_loop()
+        self._executor = (
+            executor
+            if executor
+            else lambda func, *args: self.loop.run_in_executor(None, func, *args)
+        )
+        self.configDir = configDir
+        self.dombusprotocol = None
+        self._connection = None
+        self._connection_retry = 5
+        self._connection_retry_time = 15
+        self._reconnect_task = None
+        self._closing = False  # set by async_close(): don't reconnect
+        self.deviceID = 0
+        self.devID = 0
+        self.deviceAddr = 0
+        # txQueue[frameAddr][txQueueKey(cmd,cmdLen,port)]=TxCommand(), in insertion order
+        self.txQueue = {}  # tx queue for each module
+        self.modules = (
+            {}
+        )  # modules[frameAddr]=ModuleState()
+        self.txEncoder = codec.FrameEncoder()  # reusable tx buffer, with cached module headers
+        self.txHeap = []  # heap of (nextDue, frameAddr): entries with nextDue != modules[frameAddr].nextDue are stale
+        # modules with the periodic output status due, transmitted one every STATUS_TX_INTERVAL by statusSend()
+        self.statusQueue = collections.deque()
+        self.statusNextTx = 0  # ms: time when the next periodic output status can be transmitted
+        self._txTask = None  # task that calls send() when the earliest deadline expires, see _txLoop()
+        self._txWakeup = asyncio.Event()  # set when a deadline earlier than the heap top is added
+        self._heartbeatTask = None  # task that calls heartbeat() every HEARTBEAT_INTERVAL seconds
+        self.recorder = None  # FlightRecorder with the last frames received and transmitted, see recorderStart()
+        if dbc.RECORDER_ENABLE:
+            self.recorderStart()
+        self.captureWriter = None  # CaptureWriter saving the bus traffic to file, see captureStart()
+        self.rxLatency = latency.RxLatency()  # time from bytes received to entity state written, see parseFrame()
+        self.stateWrittenTime = 0.0  # monotonic time of the last state written by an entity, see stateWritten()
+        self.commandStats = {}  # commandStats[frameAddr]=CommandStats of the commands ACKed by the module, see commandStatsGet()
+        # portsDisabled[frameAddr]=mask of disabled ports (bit0=port 1, bit31=port 32), loaded by portsDisabledInit()
+        self.portsDisabled = {}
+        self._portsDisabledStore = store.DomBusStore(
+            self.configPath(dbc.PORTSDISABLEDFILE % self._busNum),
+            self.portsDisabledData,
+            self._executor,
+            self.loop,
+        )
+        self.protocol = 2
+        self.frameAddr = 0
+        self.port = 0
+
+    @property
+    def busNum(self):
+        """Return the bus number."""
+        return self._busNum
+
+    def configPath(self, filename):
+        """Return the path of filename in the config dir."""
+        return os.path.join(self.configDir, filename)
+
+    def setLogLevel(self, logLevel):
+        """Set the log level of this bus."""
+        self.logLevel = logLevel
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.logLevel = logLevel
+
+    def newProtocol(self):
+        """Create the DomBusProtocol that decodes the frames received by a new connection."""
+        self.dombusprotocol = dombus.DomBusProtocol(
+            self.parseFrame, self.recorder, self.connectionLost
+        )
+        self.dombusprotocol.logLevel = self.logLevel
+        self.dombusprotocol.capture = self.captureWriter
+        return self.dombusprotocol
+
+    async def _connect(self):
+        """Asyncio connection serial port."""
+        protocol = self.newProtocol()
+        replay = capture.parseReplayPath(self._serialpath)
+        try:
+            if replay is not None:
+                # serial path replay://FILENAME[?speed=N]: feed a capture file instead of the serial port
+                await capture.createReplayConnection(self.loop, lambda: protocol, *replay)
+                return
+            try:
+                import serial_asyncio  # imported here: not needed by headless hubs using other transports
+            except ImportError as err:
+                # retrying is useless: the package must be installed
+                _LOGGER.error(
+                    "Could not connect to DomBus via %s: pyserial-asyncio is not installed (%s). "
+                    "Install it, or use the serial path replay://FILENAME to replay a capture file",
+                    self._serialpath,
+                    err,
+                )
+                return
+
+            await serial_asyncio.create_serial_connection(
+                self.loop,
+                lambda: protocol,
+                self._serialpath,
+                baudrate=115200,
+            )
+        except (ValueError, OSError, asyncio.TimeoutError) as err:
+            if self._closing or self._connection_retry_time <= 0:
+                return
+            _LOGGER.warning(
+                "Could not connect to DomBus via %s: %s. Retrying in %d seconds",
+                self._serialpath,
+                err,
+                self._connection_retry_time,
+            )
+            self._reconnect_task = self.loop.call_later(
+                self._connection_retry_time, self._reconnect
+            )
+            self._connection_retry -= 1
+
+    def _reconnect(self):
+        self._reconnect_task = None
+        if not self._closing:
+            asyncio.ensure_future(self._connect())
+
+    def connectionLost(self, exc):
+        """Called by DomBusProtocol when the serial port is lost unexpectedly: connect again later."""
+        if self._closing or self._connection_retry_time <= 0 or self._reconnect_task is not None:
+            return
+        _LOGGER.warning(
+            "Connection to DomBus via %s lost. Reconnecting in %d seconds",
+            self._serialpath,
+            self._connection_retry_time,
+        )
+        self._reconnect_task = self.loop.call_later(
+            self._connection_retry_time, self._reconnect
+        )
+
+    def connect(self):
+        """Connect to the serial port, and start the tx and heartbeat tasks."""
+        asyncio.ensure_future(self._connect())
+        self.startTasks()
+
+    def connectTransport(self, transport):
+        """Connect the hub to an already open transport (e.g. in memory), and start the tx and heartbeat tasks."""
+        self.newProtocol().connection_made(transport)
+        self.startTasks()
+        return self.dombusprotocol
+
+    def startTasks(self):
+        """Start the tx task and the heartbeat task, if not running."""
+        if self._txTask is None:
+            self._txTask = self.loop.create_task(self._txLoop())
+        if self._heartbeatTask is None:
+            self._heartbeatTask = self.loop.create_task(self._heartbeatLoop())
+
+    async def _txLoop(self):
+        """Call send() when the earliest deadline in the tx scheduler heap expires, also if the bus is quiet."""
+        while True:
+            self._txWakeup.clear()
+            timeout = None  # heap and statusQueue are empty: wait for txSchedule()
+            # send() leaves in the heap only future deadlines (expired entries are rescheduled, modules with the
+            # output status due are moved to statusQueue), so the timeout is 0 only for something to transmit
+            due = self.txHeap[0][0] if self.txHeap else None
+            if self.statusQueue and (due is None or self.statusNextTx < due):
+                due = self.statusNextTx  # next periodic output status, see statusSend()
+            if due is not None:
+                timeout = max(0, due - int(time.time() * 1000)) / 1000
+            if self.dombusprotocol is None or self.dombusprotocol.transport is None:
+                timeout = max(timeout or 0, 1)  # not connected: check again later
+            try:
+                await asyncio.wait_for(self._txWakeup.wait(), timeout)
+                continue  # an earlier deadline has been added: compute timeout again
+            except asyncio.TimeoutError:
+                pass
+            if (
+                self.dombusprotocol is not None
+                and self.dombusprotocol.transport is not None
+            ):
+                self.send()
+
+    async def _heartbeatLoop(self):
+        """Call heartbeat() every HEARTBEAT_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.heartbeat()
+
+    def heartbeat(self):
+        """Periodic tasks."""
+        # Decrease lastConfig counter for each module (last time we sent the CMD_CONFIG command to ask configuration)
+        for module in self.modules.values():
+            if module.lastConfig > 0:
+                module.lastConfig -= 1
+
+    async def async_close(self):
+        """Stop the tx and heartbeat tasks, close the serial port and write pending changes."""
+        self._closing = True  # intentional close: connection_lost() must not reconnect or trigger the recorder
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.closing = True
+        for task in (self._txTask, self._heartbeatTask):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._txTask = None
+        self._heartbeatTask = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        self._connection_retry_time = 0  # don't reconnect
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.close()
+        await self.captureStop()
+        await self.async_flush()
+
+    def portsDisabledData(self):
+        """Return portsDisabled in the format saved on json file."""
+        return {
+            f"0x{frameAddr:04x}": mask
+            for frameAddr, mask in sorted(self.portsDisabled.items())
+            if mask
+        }
+
+    async def portsDisabledInit(self):
+        """Read and initialize portsDisabled from json file."""
+        _LOGGER.info("portsdisabledfile=%s", self._portsDisabledStore.filename)
+        saved = await self._portsDisabledStore.load()
+        if not saved:
+            _LOGGER.info("No disabled ports in %s", self._portsDisabledStore.filename)
+            return
+        # saved={"0xff23": mask, "0xff31": [7, 8]}: lists of disabled ports are also accepted
+        for deviceAddr, ports in saved.items():
+            if isinstance(ports, list):
+                mask = 0
+                for port in ports:
+                    mask |= portMask(port)
+            else:
+                mask = int(ports)
+            self.setPortsDisabled(int(deviceAddr, 16), mask)
+
+    def isPortDisabled(self, frameAddr, port):
+        """Return True if the port of module frameAddr is disabled."""
+        return bool(self.portsDisabled.get(frameAddr, 0) & portMask(port))
+
+    def setPortsDisabled(self, frameAddr, mask):
+        """Set the mask of disabled ports for module frameAddr, and update its port table."""
+        mask &= 0xFFFFFFFF
+        if mask:
+            self.portsDisabled[frameAddr] = mask
+        else:
+            self.portsDisabled.pop(frameAddr, None)
+        ports = self._ports.get(frameAddr)
+        if ports is not None:
+            for port in range(1, dbc.PORTS_MAX + 1):
+                ports[port][dbc.PORT_DISABLED] = 1 if mask & portMask(port) else 0
+
+    def updatePortsDisabled(self, frameAddr, mask, disabled):
+        """Disable (disabled=True) or enable the ports in mask for module frameAddr, and schedule saving."""
+        current = self.portsDisabled.get(frameAddr, 0)
+        new = (current | mask) if disabled else (current & ~mask)
+        if new != current:
+            self.setPortsDisabled(frameAddr, new)
+            if new:
+                self._portsDisabledStore.append(
+                    store.JOURNAL_SET, [f"0x{frameAddr:04x}"], new
+                )
+            else:
+                self._portsDisabledStore.append(
+                    store.JOURNAL_DEL, [f"0x{frameAddr:04x}"]
+                )
+
+    def HRstatus(
+        self, hum
+    ):  # return normal, comfort, dry, wet status depending by relative humdity argument
+        """Return room comfort state based on relative humidity."""
+        if hum < 25:
+            return "2"  # dry
+        elif hum > 70:
+            return "3"  # wet
+        elif hum >= 40 and hum <= 60:  # comfortable
+            return "1"
+        else:
+            return "0"  # normal
+
+    def getDeviceID(self):
+        """From bus number, 16bit address + port (i.e. 0x0023, port 1), generate the corresponding deviceID ("H0023_P01"), devID ("23.1"), deviceAddr ("0x0023") and uniqueID ("1_0023_01")."""
+        self.deviceID = f"H{self.frameAddr:04x}_P{self.port:02x}"
+        self.devID = f"{self.frameAddr:x}.{self.port:x}"
+        self.deviceAddr = f"0x{self.frameAddr:04x}"
+        self.uniqueID = f"{self._busNum}_{self.frameAddr:04x}_{self.port:02x}"
+
+    def portTable(self, frameAddr):
+        """Return the port table of module frameAddr, creating it if not exists.
+
+        portTable[port]=[entity, disabled, rxHandlers, platform] for port=0..PORTS_MAX: used by parseFrame()
+        to get the entity associated to a port without building its uniqueID.
+        """
+        ports = self._ports.get(frameAddr)
+        if ports is None:
+            disabled = self.portsDisabled.get(frameAddr, 0)
+            ports = [
+                [None, 1 if disabled & portMask(port) else 0, None, None]
+                for port in range(0, dbc.PORTS_MAX + 1)
+            ]
+            self._ports[frameAddr] = ports
+        return ports
+
+    def txQueueAddAck(self, cmd, cmdLen, cmdAck, args, retries=1, now=1):
+        """Transmit ACK only if ACK are enabled: it's the same as txQueueAdd."""
+        if self.txAckEnabled:
+            self.txQueueAdd(cmd, cmdLen, cmdAck, args, retries, now)
+
+    def txQueueAdd(self, cmd, cmdLen, cmdAck, args, retries=1, now=1):
+        """Simplified function that call txQueueAddComplete() to send a frame to the module."""
+        self.txQueueAddComplete(
+            self.protocol,
+            self.frameAddr,
+            cmd,
+            cmdLen,
+            cmdAck,
+            self.port,
+            args,
+            retries,
+            now,
+        )
+
+    def txQueueAddComplete(
+        self, protocol, frameAddr, cmd, cmdLen, cmdAck, port, args, retries=1, now=1
+    ):
+        """Add a command in the tx queue for the specified module (frameAddr)."""
+        # if that command already exists, update it
+        # cmdLen=length of data after command (port+args[])
+        sec = int(time.time())
+        ms = int(time.time() * 1000)
+        if protocol == 0:
+            # check if module already in self.modules[]
+            if frameAddr in self.modules:
+                protocol = self.modules[frameAddr].protocol
+        queue = self.txQueue.get(frameAddr)
+        if queue is None:
+            # create self.txQueue[self.frameAddr]
+            queue = self.txQueue[frameAddr] = {}
+        key = txQueueKey(cmd, cmdLen, port)
+        f = queue.get(key)
+        # commands that wait for an ACK are traced: enqueue, transmission and ACK times, see commandStatsGet()
+        enqueueTime = monotonic() if cmdAck == 0 and retries > 1 else 0.0
+        if f is None:
+            queue[key] = TxCommand(cmd, cmdLen, cmdAck, port, args, retries, enqueueTime)
+        else:
+            # command already in self.txQueue: update values, keeping its position in the queue
+            f.cmdLen = cmdLen
+            f.cmdAck = cmdAck
+            f.args = args
+            if f.retries < retries:
+                f.retries = retries
+            # the new command replaces the old one: trace it from now
+            f.enqueueTime = enqueueTime
+            f.txTimes = None
+            # txQueueRetry: don't modify it... transmit when retry time expires (maybe now or soon)
+        # check that self.modules[self.frameAddr] exists
+        module = self.modules.get(frameAddr)
+        if module is None:
+            # add self.frameAddr in self.modules
+            self.modules[frameAddr] = ModuleState(
+                sec, ms, sec + 3 - dbc.PERIODIC_STATUS_INTERVAL, protocol
+            )  # transmit output status in 3 seconds
+        else:
+            # self.frameAddr already in self.modules[]
+            if protocol != 0:
+                module.protocol = protocol
+            if now:
+                module.lastTx = 0  # transmit now
+        self.txSchedule(frameAddr)
+
+    def txQueueAskConfig(self):
+        """Add to the txQueue the command to request device configuration."""
+        self.port = 0xFF
+        self.txQueueAdd(
+            dbc.CMD_CONFIG, 1, 0, (), dbc.TX_RETRY
+        )  # self.port=0xff to ask full configuration
+
+    def txQueueRemove(self, cmd):
+        """Remove a command from the txQueue."""
+        # if txQueue[self.frameAddr] exists, remove cmd and self.port from it.
+        # if cmd==255 => remove all frames for module self.frameAddr
+        queue = self.txQueue.get(self.frameAddr)
+        if not queue:
+            return
+        if cmd == 255:
+            queue.clear()
+        elif cmd == dbc.CMD_CONFIG:
+            # config commands with different length for the same port are queued separately: remove all of them
+            for key in [k for k in queue if k[0] == cmd and k[1] == self.port]:
+                txq = queue.pop(key)
+                if txq.txTimes is not None:
+                    self.commandStatsGet(self.frameAddr).ack(txq, self.dombusprotocol.rxTime)
+        else:
+            txq = queue.pop((cmd, self.port), None)
+            if txq is not None and txq.txTimes is not None:
+                # ACK time = when the frame with the ACK was received, without reading the clock again
+                stats = self.commandStats.get(self.frameAddr)
+                if stats is None:
+                    stats = self.commandStatsGet(self.frameAddr)
+                stats.ack(txq, self.dombusprotocol.rxTime)
+
+    def commandStatsGet(self, frameAddr):
+        """Return the CommandStats of module frameAddr, creating it: the table is limited to CMDSTATS_MODULES modules."""
+        stats = self.commandStats.get(frameAddr)
+        if stats is None:
+            if len(self.commandStats) >= dbc.CMDSTATS_MODULES:
+                del self.commandStats[next(iter(self.commandStats))]  # remove the oldest module
+            stats = self.commandStats[frameAddr] = latency.CommandStats()
+        return stats
+
+    def commandStatsSummary(self):
+        """Return the command statistics of each module, used by diagnostics."""
+        return {
+            f"{frameAddr:04x}": stats.summary()
+            for frameAddr, stats in sorted(self.commandStats.items())
+        }
+
+    def txOutputsStatus(self, frameAddr):
+        """Transmit periodic status of outputs."""
+        # transmit the status of outputs for the device frameAddr
+        ports = self._ports.get(frameAddr)
+        if ports is None:
+            return
+        for port in range(1, dbc.PORTS_MAX + 1):
+            (entity, portDisabled, handlers, platform) = ports[port]
+            if entity is None or portDisabled:
+                continue
+            if platform == "light":
+                value = int(entity.brightness / 12.75) if entity.is_on else 0
+            elif platform == "switch":
+                value = 1 if entity.is_on else 0
+            else:
+                continue  # not an output
+            # protocol=0 => protocol unknown: auto detect
+            self.txQueueAddComplete(
+                0, frameAddr, dbc.CMD_SET, 2, 0, port, (value,), dbc.TX_RETRY
+            )
+
+    def registerEntity(self, entityConfig):
+        """Register a new entity and save it in memory."""
+        self.registerEntities((entityConfig,))
+
+    def registerEntities(self, entityConfigs):
+        """Register a list of entities and save them in memory: entities are added by the sink with one call."""
+        start = time.monotonic()
+        devices = self.devices
+        newEntities = []
+        for entityConfig in entityConfigs:
+            uniqueID = entityConfig[0]
+            port = entityConfig[1][3]
+            platform = entityConfig[1][5]
+            if port > dbc.PORTS_MAX:
+                continue  # ignore: maybe this is a CONFIG command to ask for configuration
+
+            if (
+                len(entityConfig[3]) == 2
+            ):  # add descr (configuration), that was missing in the first version
+                entityConfig[3].append("")
+
+            if devices.get(uniqueID) != entityConfig:
+                # new or changed entity: save it
+                devices[uniqueID] = entityConfig
+                self.sink.saveEntityConfig(uniqueID, entityConfig)
+
+            entity = self.sink.createEntity(self, entityConfig)
+            if entity is None:
+                continue
+            self.entities[uniqueID] = entity
+            slot = self.portTable(entityConfig[1][2])[port]
+            slot[dbc.PORT_ENTITY] = entity
+            slot[dbc.PORT_HANDLERS] = self.rxHandlers(entity, entityConfig[4])
+            slot[dbc.PORT_PLATFORM] = platform
+            _LOGGER.debug(
+                "Register new entity for platform=%s, uniqueID=%s, name=%s",
+                platform,
+                uniqueID,
+                entity.name,
+            )
+            newEntities.append(entity)
+
+        if newEntities:
+            self.sink.addEntities(newEntities)
+            _LOGGER.info(
+                "Registered %d entities on bus %d in %.1f ms",
+                len(newEntities),
+                self._busNum,
+                (time.monotonic() - start) * 1000,
+            )
+
+    def rxConfigReply(self, args):
+        """Parse the full port configuration received from the module, and create the missing entities."""
+        ports = self.portTable(self.frameAddr)
+        entityConfigs = []
+        for self.port, (portType, portOpt, portName) in enumerate(
+            codec.decodeConfigReply(args), 1
+        ):
+            if self.port > dbc.PORTS_MAX:
+                break
+            # check if this port device already exists?
+            (entity, portDisabled, handlers, _) = ports[self.port]
+            if portDisabled or portType == dbc.PORTTYPE_DISABLED:
+                continue  # port is disabled
+            if entity:
+                # unit found => remove TimedOut if set
+                if self.port == 1:
+                    _LOGGER.info("Device %x.1 is now active again", self.frameAddr)
+                continue
+            self.getDeviceID()
+
+            # port device not found, and is not disabled: create it!
+            if portType not in dbc.PORT_TYPENAME:
+                portType = dbc.PORTTYPE_IN_DIGITAL  # default: Digital Input
+            if portType not in PORTTYPE_ENTITY:
+                # entityConfig cannot be added to HA
+                _LOGGER.warning(
+                    "Entity cannot be added: devID=%s, name=%s, porttype=%s",
+                    self.devID,
+                    portName,
+                    dbc.PORT_TYPENAME[portType],
+                )
+                continue
+            (platform, descr, opts) = PORTTYPE_ENTITY[portType]
+            for key, value in dbc.PORTOPTS.items():
+                if value & portOpt:
+                    descr += "," + key
+            entityConfigs.append(
+                [
+                    self.uniqueID,
+                    [
+                        self._busNum,
+                        self.protocol,
+                        self.frameAddr,
+                        self.port,
+                        self.devID,
+                        platform,
+                    ],
+                    "[" + self.devID + "] " + portName,
+                    [portType, portOpt, descr],
+                    dict(opts),
+                ]
+            )
+        self.registerEntities(entityConfigs)
+
+    def stateWritten(self):
+        """Called by the entities just after writing their state: used by parseFrame() to measure rxLatency."""
+        self.stateWrittenTime = monotonic()
+
+    def rxHandlers(self, entity, opts):
+        """Return the dict {cmd|cmdAck: handler} for the entity port type, from RX_DISPATCH table."""
+        handlers = {}
+        for (cmd, cmdAck, porttype), name in RX_DISPATCH.items():
+            if porttype == entity.porttype:
+                handlers[cmd | cmdAck] = functools.partial(
+                    getattr(self, name), entity, opts
+                )
+        return handlers
+
+    def rxSetDigital(self, entity, opts, args):
+        """Update digital input or output: args[0]=0 (off) or 1 (on)."""
+        if len(args) == 1:
+            if args[0] == 0:
+                if entity.is_on:
+                    entity.turn_off()
+            elif entity.is_on is False:
+                entity.turn_on()
+
+    def rxSetCounter(self, entity, opts, args):
+        """Update counter: args[0] contains the number of pulses received in the interval."""
+        if len(args) == 1 and args[0] != 0:  # at least 1 pulse received
+            pulses = args[0]
+            if entity.unit_of_measurement == ENERGY_KILO_WATT_HOUR:
+                entity.setstate(
+                    entity._attr_state + pulses / 1000.0
+                )  # pulses = number of Wh => convert to kWh
+            else:
+                entity.setstate(pulses)
+            # Compute power?
+            if entity.device_class == DEVICE_CLASS_ENERGY:
+                ms = int(time.time() * 1000)
+                msdiff = ms - entity.last_pulses  # elapsed time since last value
+                if (
+                    msdiff >= 2000
+                ):  # check that frames do not come too fast (HA busy?)
+                    # at least 2 seconds from last frame: ok
+                    entity.power = int(pulses * 3600000 / msdiff)
+                entity.last_pulses = ms
+
+    def rxSetTemperature(self, entity, opts, args):
+        """Update temperature sensor: 16bit value in Kelvin*10."""
+        if len(args) >= 2:
+            temp = round((args[0] * 256 + args[1]) / 10.0 - 273.1, 1)
+            if temp > -50:
+                entity.setstate(temp)
+
+    def rxSetHumidity(self, entity, opts, args):
+        """Update relative humidity sensor: 16bit value in %*10."""
+        if len(args) >= 2:
+            hum = int((args[0] * 256 + args[1]) / 10)
+            if hum > 5:
+                entity.setstate(hum)
+
+    def rxSetAnalog(self, entity, opts, args):
+        """Update analog input or distance: VALUE=A*dombus_value+B, with A and B set by the options flow."""
+        if len(args) >= 2:
+            value = args[0] * 256 + args[1]  # compute 16bit value
+            entity.setstate(opts.get("a", 1) * value + opts.get("b", 0))
+
+    def rxSetTwinButton(self, entity, opts, args):
+        """Update twinbutton: args[0]=0 (no button), 1 or 2 (pressed button)."""
+        if len(args) == 1:
+            entity.setstate(args[0])
+
+    def parseFrame(self, protocol, frameAddr, dstAddr, rxbuffer):
+        """Get frame from DomBusProtocol and parse it.
+
+        rxbuffer is a read-only memoryview of the frame payload, referencing the protocol rx buffer:
+        it's valid only during this call and must not be stored.
+        """
+        if self.rxEnabled is False:
+            _LOGGER.warning("Frame parsing is disabled while initializing")
+            return  # frame from another controller: ignore it
+        elif frameAddr == 0:
+            _LOGGER.debug("Skip frame from another controller")
+            return
+        self.protocol = protocol
+        self.frameAddr = frameAddr
+        module = self.modules.get(self.frameAddr)
+        if module is None:
+            # first time receive data from this module: ask for configuration?
+            module = self.modules[self.frameAddr] = ModuleState(
+                int(time.time()), 0, 0, self.protocol
+            )  # transmit now the output status
+        ports = self.portTable(self.frameAddr)
+        updateTime = 0.0  # monotonic time of the first entity update, for rxLatency
+        self.stateWrittenTime = 0.0  # set by stateWritten() when an entity writes its state
+        for cmd, cmdAck, cmdLen, self.port, args in codec.iterCommands(
+            self.protocol, rxbuffer
+        ):
+            # args = bytes after port
+            arg1 = args[0] if (len(args) >= 1) else 0
+            arg2 = args[1] if (len(args) >= 2) else 0
+
+            module.protocol = self.protocol
+            module.lastRx = int(time.time())
+            if self.port <= dbc.PORTS_MAX:
+                (entity, portDisabled, handlers, _) = ports[self.port]
+                if portDisabled:
+                    entity = None
+            else:
+                # port 0xFE or 0xFF used by CMD_CONFIG
+                entity = None
+                portDisabled = 0
+
+            if entity is None:
+                # entry does not exist
+                if portDisabled == 0:
+                    # got a frame from a unknown device, that is not disabled => ask for configuration
+                    if (
+                        self.port <= dbc.PORTS_MAX
+                        and module.lastConfig == 0
+                    ):
+                        # never sent Config request, or sent long time ago
+                        module.lastConfig = 60  # timeout, decreased by _heartbeat()
+                        self.txQueueAskConfig()
+                    else:
+                        # configuration request is not possible: transmits ACK to avoid retransmissions of the same frame
+                        self.txQueueAddAck(dbc.CMD_SET, 2, dbc.CMD_ACK, (arg1,))
+                else:
+                    # ports is disabled => send ACK anyway, to prevent useless retries
+                    self.txQueueAddAck(dbc.CMD_SET, 2, dbc.CMD_ACK, (arg1,))  # Tx ACK
+
+            if cmdAck:
+                # received an ack: remove cmd+arg1 from txQueue, if present
+                if self.frameAddr != 0 and self.frameAddr != 0xFFFF:
+                    # Received ACK from a slave module => remove cmd from txQueue
+                    self.txQueueRemove(cmd)
+                    module.retry = 0
+
+                if cmd == dbc.CMD_CONFIG and dstAddr == 0:
+                    if self.port == 0xFF:
+                        # 0xff VERSION PORTTYPE PORTOPT PORTCAPABILITIES PORTIMAGE PORTNAME
+                        self.rxConfigReply(args)
+
+                    elif self.port == 0xFE:  # Version
+                        if cmdLen >= 8:
+                            strVersion = str(args[0:4], "utf-8")
+                            strModule = str(args[4 : cmdLen - 2], "utf-8")
+                            _LOGGER.info(
+                                "Module %s Rev.%s Addr=%x",
+                                strModule,
+                                strVersion,
+                                self.frameAddr,
+                            )
+                            module.lastStatus = 0  # force transmit output status
+
+                # TODO elif (cmd==CMD_DCMD): #decode DCMD frame to get the STATUS word?
+
+            else:
+                # cmdAck==0 => decode command from slave module
+                if self.frameAddr != 0xFFFF and dstAddr == 0:
+                    # Receive command from a slave module
+                    if cmd == dbc.CMD_GET:
+                        if (
+                            self.port == 0
+                        ):  # port==0 => request from module to get status of all output!  NOT USED by any module, actually
+                            self.txQueueAddAck(
+                                dbc.CMD_GET, 1, dbc.CMD_ACK, ()
+                            )  # Tx ACK
+                            module.lastStatus = 0  # force transmit output status
+                    elif cmd == dbc.CMD_SET:
+                        # check that entity exists
+                        if entity is None:
+                            if portDisabled == 1:
+                                # ports is disabled => send ACK anyway, to prevent useless retries
+                                self.txQueueAddAck(
+                                    dbc.CMD_SET, 2, dbc.CMD_ACK, (arg1,)
+                                )  # Tx ACK
+                        else:
+                            # got a frame from a well known device: call the handler for this port type, if defined
+                            handler = handlers.get(cmd | cmdAck)
+                            if handler is not None:
+                                if not updateTime:
+                                    updateTime = monotonic()  # first entity update of this frame
+                                handler(args)
+                            # transmit ACK to the bus
+                            if cmdLen == 2:
+                                self.txQueueAddAck(dbc.CMD_SET, 2, dbc.CMD_ACK, (arg1,))
+                            elif cmdLen == 3 or cmdLen == 4:
+                                self.txQueueAddAck(
+                                    dbc.CMD_SET, 3, dbc.CMD_ACK, (arg1, arg2, 0)
+                                )
+
+        if updateTime and self.stateWrittenTime:
+            # bytes received -> frame complete -> first entity update -> last state written
+            # (frames that do not change any state are not recorded)
+            self.rxLatency.record(
+                self.dombusprotocol.rxStartTime,
+                self.dombusprotocol.rxTime,
+                updateTime,
+                self.stateWrittenTime,
+            )
+        if self.frameAddr != 0xFFFF:
+            self.txSchedule(self.frameAddr)  # retry or status deadline may be changed
+        self.send()  # Transmit!
+
+    def txDue(self, frameAddr, module):
+        """Return the next deadline (ms) for module: retry if txQueue is not empty, else periodic status or alive check."""
+        if self.txQueue.get(frameAddr):
+            retry = module.retry  # number of retris (0,1,2,3...): used to compute the retry period
+            if retry > dbc.TX_RETRY:
+                retry = dbc.TX_RETRY
+            return module.lastTx + (dbc.TX_RETRY_TIME << (retry + 1)) + 1
+        if module.statusQueued:
+            due = dbc.TX_DUE_NEVER  # periodic status already waiting in statusQueue, see statusSend()
+        else:
+            due = (module.lastStatus + dbc.PERIODIC_STATUS_INTERVAL + 1) * 1000
+        if module.protocol == 2 or dbc.PROTOCOL1_WITH_PERIODIC_TX:
+            due = min(due, (module.lastRx + dbc.MODULE_ALIVE_TIME + 1) * 1000)
+        return due
+
+    def txSchedule(self, frameAddr):
+        """Update the deadline of module frameAddr in the tx scheduler heap, if it's earlier than the current one."""
+        # must run in the event loop: txHeap and _txWakeup (asyncio.Event) are not thread safe
+        module = self.modules.get(frameAddr)
+        if module is None:
+            return
+        due = self.txDue(frameAddr, module)
+        if due < module.nextDue:
+            # a later deadline is left in the heap: when popped, the module is checked again and rescheduled
+            module.nextDue = due
+            heapq.heappush(self.txHeap, (due, frameAddr))
+            if self.txHeap[0][0] == due:
+                self._txWakeup.set()  # new earliest deadline: wake up the tx task
+
+    def send(self):
+        """Check modules with an expired deadline in the tx scheduler heap: transmit frames, output status, remove dead modules."""
+        # txQueue[self.frameAddr]={(cmd, port): TxCommand(cmd, cmdLen, cmdAck, port, [arg1, arg2, arg3, ...], retries)}
+        tx = 0
+        ms = int(time.time() * 1000)
+        sec = ms // 1000
+        txHeap = self.txHeap
+        while txHeap and txHeap[0][0] <= ms:
+            (due, frameAddr) = heapq.heappop(txHeap)
+            module = self.modules.get(frameAddr)
+            if module is None or module.nextDue != due:
+                continue  # module removed, or deadline moved earlier: stale entry
+            module.nextDue = dbc.TX_DUE_NEVER
+            if self.txQueue.get(frameAddr):
+                retry = module.retry
+                if retry > dbc.TX_RETRY:
+                    retry = dbc.TX_RETRY
+                if ms - module.lastTx > (dbc.TX_RETRY_TIME << (retry + 1)):
+                    tx = 1
+                    self.txFrame(frameAddr, module, ms)
+            elif sec - module.lastRx > dbc.MODULE_ALIVE_TIME and (
+                module.protocol == 2 or dbc.PROTOCOL1_WITH_PERIODIC_TX
+            ):
+                # too long time since last RX from this module: remove it from modules
+                # Note: if protocol==1, maybe it uses an old firmware that does not transmit status periodically: don't remove it
+                _LOGGER.info("Removing module %x because it's not alive", frameAddr)
+                del self.modules[frameAddr]
+                # also remove any cmd in the txQueue
+                self.txQueue.pop(frameAddr, None)
+                # TODO: set device as unavailable
+                continue
+            elif sec - module.lastStatus > dbc.PERIODIC_STATUS_INTERVAL and not module.statusQueued:
+                # output status due: wait in statusQueue, out of the heap, until statusSend() transmits it
+                module.statusQueued = True
+                self.statusQueue.append(frameAddr)
+            self.txSchedule(frameAddr)
+
+        if self.statusQueue and ms >= self.statusNextTx:
+            if tx:
+                # send output status only when nothing else has been transmitted
+                self.statusNextTx = ms + dbc.STATUS_TX_INTERVAL
+            else:
+                self.statusSend(ms)
+
+    def statusSend(self, ms):
+        """Transmit the output status of the first module in statusQueue: the next one after STATUS_TX_INTERVAL ms."""
+        sec = ms // 1000
+        statusQueue = self.statusQueue
+        while statusQueue:
+            frameAddr = statusQueue.popleft()
+            module = self.modules.get(frameAddr)
+            if module is None or not module.statusQueued:
+                continue  # module removed (and maybe added again) while waiting
+            module.statusQueued = False
+            module.lastStatus = sec + (
+                frameAddr & 0x000F
+            )  # set current time + extra seconds to avoid all devices been refresh together
+            self.txOutputsStatus(frameAddr)
+            retry = min(module.retry, dbc.TX_RETRY)
+            if self.txQueue.get(frameAddr) and ms - module.lastTx > (dbc.TX_RETRY_TIME << (retry + 1)):
+                self.txFrame(frameAddr, module, ms)  # else the retry deadline is in the heap
+            self.txSchedule(frameAddr)
+            self.statusNextTx = ms + dbc.STATUS_TX_INTERVAL
+            return
+
+    def txFrame(self, frameAddr, module, ms):
+        """Build and transmit a frame with the commands in txQueue[frameAddr]."""
+        protocol = module.protocol  # 1=old protocol, 2=new protocol
+        retry = module.retry
+        if protocol == 0 and retry >= dbc.TX_RETRY - 5 and (retry & 1):
+            protocol = 1  # protocol not defined: maybe it's a old device that does not transmit periodic status
+        encoder = self.txEncoder
+        encoder.begin(protocol, frameAddr)
+        queue = self.txQueue[frameAddr]
+        sent = []  # keys of commands to remove from the queue
+        now = 0.0  # read only if the frame contains traced commands
+        for key, txq in queue.items():
+            if encoder.length + txq.cmdLen + 2 >= dbc.FRAME_LEN_MAX:
+                break  # frame must be truncated
+            encoder.add(txq.cmd, txq.cmdLen, txq.cmdAck, txq.port, txq.args)
+            if txq.enqueueTime:
+                # traced command: record the time of the first transmission and of each retransmission
+                if not now:
+                    now = monotonic()
+                if txq.txTimes is None:
+                    txq.txTimes = [now]
+                else:
+                    txq.txTimes.append(now)
+
+            # if this cmd is an ACK, or values[0]==1, remove command from the queue
+            if txq.cmdAck or txq.retries <= 1:
+                sent.append(key)
+                if txq.enqueueTime:
+                    self.commandStatsGet(frameAddr).expire(txq)  # last retry: the ACK will not be traced
+            else:
+                txq.retries -= 1  # command, no ack: decrement retry
+        for key in sent:
+            del queue[key]
+        module.retry += 1  # increment RETRY to multiply the retry period * 2
+        if module.retry >= dbc.TX_RETRY:
+            module.retry = 4
+            module.protocol = 0  # module does not renspond => reset protocol so both protocol 1 and 2 will be checked next time
+        txbuffer = encoder.finish()  # set length and checksum
+        self.dombusprotocol.send(txbuffer)
+        if self.dombusprotocol.dumpEnabled(protocol):
+            self.dombusprotocol.dump(protocol, txbuffer, len(txbuffer), "TX")
+        module.lastTx = ms
+
+    def recorderStart(self):
+        """Start recording the frames received and transmitted in a new flight recorder."""
+        if self.recorder is not None:
+            return
+        self.recorder = recorder.FlightRecorder()
+        self.recorder.onTrigger = self.recorderTrigger
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.recorder = self.recorder
+        _LOGGER.info("DomBus bus %d: flight recorder started", self._busNum)
+
+    def recorderStop(self):
+        """Stop recording, and free the flight recorder."""
+        if self.recorder is None:
+            return
+        self.recorder = None
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.recorder = None
+        _LOGGER.info("DomBus bus %d: flight recorder stopped", self._busNum)
+
+    def recorderLines(self):
+        """Return the frames in the flight recorder, in readable form (empty if not started)."""
+        if self.recorder is None:
+            return []
+        return recorder.snapshotLines(self.recorder.snapshot())
+
+    async def recorderFlush(self, reason="service call"):
+        """Write the frames in the flight recorder to a file in the config dir: return the file name."""
+        if self.recorder is None:
+            return None  # stopped by the service recorder_stop
+        frames = self.recorder.snapshot()  # copy in the event loop, format and write in the executor
+        now = time.monotonic()
+        wallNow = time.time()
+        filename = self.configPath(
+            dbc.RECORDERFILE
+            % (self._busNum, time.strftime("%Y%m%d-%H%M%S", time.localtime(wallNow)))
+        )
+        header = f"DomBus bus {self._busNum} on {self._serialpath}: {len(frames)} frames, {reason}"
+        try:
+            await self._executor(
+                lambda: recorder.snapshotWrite(
+                    filename, header, recorder.snapshotLines(frames, now, wallNow)
+                )
+            )
+        except OSError as e:
+            _LOGGER.error("Error writing file %s: %s", filename, e)
+            return None
+        _LOGGER.info("Flight recorder of bus %d written to %s (%s)", self._busNum, filename, reason)
+        return filename
+
+    def recorderTrigger(self, reason):
+        """Called by the flight recorder on checksum error bursts or connection lost: write it to file."""
+        _LOGGER.warning("DomBus bus %d: %s, writing flight recorder", self._busNum, reason)
+        self.loop.create_task(self.recorderFlush(reason))
+
+    def captureStart(self, filename=None):
+        """Start saving the bus traffic to a capture file (default: CAPTUREFILE in the config dir)."""
+        if self.captureWriter is not None:
+            return
+        if filename is None:
+            filename = self.configPath(dbc.CAPTUREFILE % self._busNum)
+        self.captureWriter = capture.CaptureWriter(filename, self._executor, self.loop)
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.capture = self.captureWriter
+        _LOGGER.info("DomBus bus %d: capture started to %s", self._busNum, filename)
+
+    async def captureStop(self):
+        """Stop saving the bus traffic, and write the pending records."""
+        writer = self.captureWriter
+        if writer is None:
+            return
+        self.captureWriter = None
+        if self.dombusprotocol is not None:
+            self.dombusprotocol.capture = None
+        await writer.close()
+        _LOGGER.info(
+            "DomBus bus %d: capture stopped, %d records in %s",
+            self._busNum,
+            writer.records,
+            writer.filename,
+        )
+
+    async def async_flush(self):
+        """Write pending changes to disabled ports."""
+        if self._portsDisabledStore.pending:
+            await self._portsDisabledStore.flush()
+
+
+def txQueueKey(cmd, cmdLen, port):
+    """Return the key of a command in txQueue[frameAddr]: a new command with the same key replaces the queued one."""
+    if cmd == dbc.CMD_CONFIG:
+        return (cmd, port, cmdLen)  # port type, calibration, ... are different config commands for the same port
+    return (cmd, port)
+
+
+def portMask(port):
+    """Return the bit associated to port in the mask of disabled ports (port 0 cannot be disabled)."""
+    return (1 << (port - 1)) if 1 <= port <= dbc.PORTS_MAX else 0
+
+
+def configDataInit(data, entryId):
+    """Initialize the structure of the config data (hass.data[DOMAIN]) for the bus entryId.
+
+    data[CONF_SAVED] must already contain the saved config file (or an empty dict): see configFileInit() in __init__.py.
+    """
+    # check if CONF_BUSNUM dictionary exists (associate a bus number to the current bus)
+    if CONF_BUSNUM not in data[CONF_SAVED]:
+        # CONF_BUSNUM does not exist: set the current bus number = 1
+        data[CONF_SAVED][CONF_BUSNUM] = {entryId: 1, "next": 2}
+        data[CONF_SAVED][CONF_BUSNUMENTRY] = {1: entryId}
+    else:
+        # check the CONF_BUSNUM for this bus
+        if entryId not in data[CONF_SAVED][CONF_BUSNUM]:
+            # CONF_BUSNUM not set for the current bus => initialize it to the next available value
+            data[CONF_SAVED][CONF_BUSNUM][entryId] = data[CONF_SAVED][
+                CONF_BUSNUM
+            ]["next"]
+            data[CONF_SAVED][CONF_BUSNUM]["next"] += 1
+            data[CONF_SAVED][CONF_BUSNUMENTRY][
+                data[CONF_SAVED][CONF_BUSNUM][entryId]
+            ] = entryId
+
+        data[CONF_SAVED][CONF_BUSNUMENTRY] = {1: entryId}  # DEBUG
+
+    if CONF_DEVICES not in data[CONF_SAVED]:
+        data[CONF_SAVED][CONF_DEVICES] = {}
+
+    # check that config has inside a dict for the current bus with the list of devices
+    if entryId not in data[CONF_SAVED][CONF_DEVICES]:
+        data[CONF_SAVED][CONF_DEVICES][entryId] = {}
+
+    # check that entity structure exists
+    if CONF_ENTITIES not in data:
+        data[CONF_ENTITIES] = {}
+
+    if entryId not in data[CONF_ENTITIES]:
+        data[CONF_ENTITIES][entryId] = {}
+
+    # check data["async_add_entities"]
+    if "async_add_entities" not in data:
+        data["async_add_entities"] = {}
@@ -0,0 +1,151 @@
+"""Latency histograms: time from the bytes received on the bus to the entity state written, and from a command queued to its ACK.
+
+Each histogram counts the samples in LATENCY_BUCKETS log-scale buckets: recording is a bisect and an
+increment, with no memory growth, so it can run for every frame. Percentiles are returned as the upper
+bound of the bucket where they fall; the number of samples is computed only when a summary is requested.
+
+This module does not depend on Home Assistant, so it can be used by tools and benchmarks.
+"""
+
+from bisect import bisect_left
+from collections import deque
+
+from . import creasol_dombus_const as dbc
+
+# bucket upper bounds in seconds: LATENCY_MIN * 2^(n / LATENCY_BUCKETS_PER_OCTAVE), the last one is infinite
+# so that bisect_left() always returns a valid bucket
+LATENCY_BOUNDS = tuple(
+    dbc.LATENCY_MIN * 2 ** (n / dbc.LATENCY_BUCKETS_PER_OCTAVE)
+    for n in range(dbc.LATENCY_BUCKETS - 1)
+) + (float("inf"),)
+
+# stages of the rx path measured by RxLatency
+RX_STAGES = (
+    "bus",  # first byte of the frame received -> last byte received (serial transmission, gaps)
+    "parse",  # last byte received -> entity update (decode, parseFrame, event loop delay inside data_received)
+    "state",  # first entity update -> last state written by an entity (async_write_ha_state()) for the frame
+    "total",  # first byte received -> last state written
+)
+
+
+class LatencyHistogram:
+    """Histogram of latencies in seconds."""
+
+    def __init__(self):
+        """Initialize empty buckets."""
+        # list instead of array: incrementing an item does not convert the value from and to a C long
+        self.counts = [0] * dbc.LATENCY_BUCKETS
+
+    def record(self, seconds):
+        """Add a sample."""
+        self.counts[bisect_left(LATENCY_BOUNDS, seconds)] += 1
+
+    def percentile(self, p):
+        """Return the upper bound (seconds) of the bucket with the p-th percentile, or 0 if empty."""
+        rank = sum(self.counts) * p / 100
+        total = 0
+        for n, count in enumerate(self.counts):
+            total += count
+            if total >= rank and total:
+                return LATENCY_BOUNDS[n]
+        return 0.0
+
+    def summary(self):
+        """Return the number of samples, p50, p95 and p99 in milliseconds (inf if over the last bucket bound)."""
+        return {
+            "count": sum(self.counts),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+        }
+
+    def reset(self):
+        """Remove all samples."""
+        for n in range(dbc.LATENCY_BUCKETS):
+            self.counts[n] = 0
+
+
+class RxLatency:
+    """Latency histograms of the rx path of a bus, one for each stage in RX_STAGES."""
+
+    def __init__(self):
+        """Initialize the histograms."""
+        self.bus = LatencyHistogram()
+        self.parse = LatencyHistogram()
+        self.state = LatencyHistogram()
+        self.total = LatencyHistogram()
+
+    def record(self, rxStartTime, rxTime, updateTime, writtenTime):
+        """Add the monotonic times of a frame: first byte received, last byte received, entity update, state written."""
+        # called for each frame: histograms are updated inline, without calling LatencyHistogram.record()
+        self.bus.counts[bisect_left(LATENCY_BOUNDS, rxTime - rxStartTime)] += 1
+        self.parse.counts[bisect_left(LATENCY_BOUNDS, updateTime - rxTime)] += 1
+        self.state.counts[bisect_left(LATENCY_BOUNDS, writtenTime - updateTime)] += 1
+        self.total.counts[bisect_left(LATENCY_BOUNDS, writtenTime - rxStartTime)] += 1
+
+    def summary(self):
+        """Return {stage: histogram summary}."""
+        return {stage: getattr(self, stage).summary() for stage in RX_STAGES}
+
+    def reset(self):
+        """Remove all samples."""
+        for stage in RX_STAGES:
+            getattr(self, stage).reset()
+
+
+class CommandStats:
+    """Statistics of the traced commands transmitted to a module: RTT, retries per command, time to ACK."""
+
+    def __init__(self):
+        """Initialize the counters and histograms."""
+        self.acked = 0  # commands ACKed by the module
+        self.expired = 0  # commands removed from the tx queue after the last retry, without ACK
+        # retries[n]=commands ACKed after n retransmissions (the last item also counts more retransmissions)
+        self.retries = [0] * (dbc.TX_RETRY + 1)
+        self.rtt = LatencyHistogram()  # last transmission -> ACK
+        self.ackTime = LatencyHistogram()  # queued -> ACK
+        self.recent = deque(maxlen=dbc.CMDSTATS_RECENT)  # last completed traces: (TxCommand, ACK time or None)
+
+    def ack(self, txq, ackTime):
+        """Add a command ACKed at monotonic time ackTime: txq.enqueueTime and txq.txTimes are set."""
+        # called for each ACK: histograms are updated inline, without calling LatencyHistogram.record()
+        txTimes = txq.txTimes
+        self.acked += 1
+        retries = len(txTimes) - 1
+        self.retries[retries if retries < dbc.TX_RETRY else dbc.TX_RETRY] += 1
+        self.rtt.counts[bisect_left(LATENCY_BOUNDS, ackTime - txTimes[-1])] += 1
+        self.ackTime.counts[bisect_left(LATENCY_BOUNDS, ackTime - txq.enqueueTime)] += 1
+        self.recent.append((txq, ackTime))
+
+    def expire(self, txq):
+        """Add a command removed from the tx queue without ACK."""
+        self.expired += 1
+        self.recent.append((txq, None))
+
+    def summary(self):
+        """Return the statistics, with the recent traces in milliseconds since the command was queued (tx_ms: each transmission)."""
+        acked = self.acked
+        return {
+            "acked": acked,
+            "expired": self.expired,
+            "retries_per_command": round(
+                sum(n * count for n, count in enumerate(self.retries)) / acked, 2
+            )
+            if acked
+            else 0,
+            "retries": {n: count for n, count in enumerate(self.retries) if count},
+            "rtt": self.rtt.summary(),
+            "time_to_ack": self.ackTime.summary(),
+            "recent": [
+                {
+                    "cmd": txq.cmd,
+                    "port": txq.port,
+                    "args": list(txq.args),
+                    "tx_ms": [round((t - txq.enqueueTime) * 1000, 3) for t in txq.txTimes],
+                    "ack_ms": round((ackTime - txq.enqueueTime) * 1000, 3)
+                    if ackTime is not None
+                    else None,
+                }
+                for txq, ackTime in self.recent
+            ],
+        }
@@ -0,0 +1,162 @@
+"""Flight recorder: the last frames received and transmitted on the bus, kept in memory and written out on demand.
+
+Data is copied into a preallocated bytearray used as a ring: each record is stored contiguously
+(when it does not fit before the end of the ring, it starts again from offset 0), and its absolute
+position, length and direction (packed in a single integer) and its monotonic timestamp are written
+into two fixed-size arrays.
+Old records are never removed: a record is valid while its bytes have not been overwritten, i.e.
+when its position is not older than the last RECORDER_SIZE bytes written.
+
+A TX record is a frame. A RX record is all the data decoded by a single DomBusProtocol.decode() call
+(one or more frames, maybe with garbage or wrong checksums), so that decoding a frame costs nothing:
+RX records are split into frames only by snapshot(), using the same checks of the decoder.
+
+This module does not depend on Home Assistant, so it can be used by tools and benchmarks.
+"""
+
+from array import array
+from operator import itemgetter
+import time
+from time import monotonic
+
+from . import creasol_dombus_codec as codec, creasol_dombus_const as dbc
+
+# record directions
+REC_RX = 0  # frame received with a valid checksum (recorded: data decoded by decode())
+REC_TX = 1  # frame transmitted
+REC_RX_ERROR = 2  # frame received with a wrong checksum (only in snapshot())
+REC_NAMES = ("RX", "TX", "RX-ERR")
+
+
+class FlightRecorder:
+    """Ring buffer of the last frames exchanged on the bus."""
+
+    def __init__(self, size=dbc.RECORDER_SIZE, records=dbc.RECORDER_RECORDS):
+        """Allocate the data ring (size bytes) and the record arrays (records entries)."""
+        self.size = size
+        self.data = bytearray(size)
+        self.records = records
+        self.recInfo = array("q", bytes(8 * records))  # absolute position << 24 | length << 8 | direction
+        self.recTime = array("d", bytes(8 * records))  # time.monotonic() when the frame was recorded
+        self.count = 0  # number of frames recorded since start: next record is count % records
+        self.pos = 0  # absolute number of bytes written to the data ring, including the skipped tails
+        self.onTrigger = None  # onTrigger(reason) called by trigger(), e.g. to flush the recorder to a file
+        self._errors = 0  # checksum errors in the current burst window
+        self._errorsTime = 0.0  # start of the current burst window
+        self._triggerTime = -dbc.RECORDER_TRIGGER_INTERVAL  # time of the last automatic trigger
+
+    def record(self, direction, buffer, start, length, now):
+        """Copy buffer[start:start+length], received or transmitted at monotonic time now, into the ring.
+
+        buffer can be bytes, bytearray or memoryview. Data longer than the ring (or than 0xFFFF bytes,
+        the max length in recInfo) is truncated at the beginning.
+        """
+        size = self.size
+        if length > size or length > 0xFFFF:
+            maxLength = min(size, 0xFFFF)
+            start += length - maxLength
+            length = maxLength
+        pos = self.pos
+        offset = pos % size
+        if offset + length > size:
+            pos += size - offset  # skip the ring tail, so the record is contiguous
+            offset = 0
+        self.data[offset : offset + length] = buffer[start : start + length]
+        i = self.count % self.records
+        self.recInfo[i] = (pos << 24) | (length << 8) | direction
+        self.recTime[i] = now
+        self.pos = pos + length
+        self.count += 1
+
+    def checksumError(self):
+        """Count a checksum error: call trigger() when RECORDER_BURST_ERRORS errors occur within RECORDER_BURST_TIME seconds."""
+        now = monotonic()
+        if now - self._errorsTime > dbc.RECORDER_BURST_TIME:
+            self._errorsTime = now
+            self._errors = 0
+        self._errors += 1
+        if self._errors == dbc.RECORDER_BURST_ERRORS:
+            self.trigger("checksum errors burst")
+
+    def trigger(self, reason):
+        """Call onTrigger(reason), at most once every RECORDER_TRIGGER_INTERVAL seconds."""
+        now = monotonic()
+        if self.onTrigger is None or now - self._triggerTime < dbc.RECORDER_TRIGGER_INTERVAL:
+            return
+        self._triggerTime = now
+        self.onTrigger(reason)
+
+    def snapshot(self):
+        """Return the valid frames, oldest first, as a list of (monotonic time, direction, frame bytes)."""
+        records = self.records
+        oldest = self.pos - self.size  # bytes before this position have been overwritten
+        frames = []
+        for n in range(max(0, self.count - records), self.count):
+            i = n % records
+            info = self.recInfo[i]
+            pos = info >> 24
+            if pos < oldest:
+                continue
+            offset = pos % self.size
+            length = (info >> 8) & 0xFFFF
+            data = bytes(self.data[offset : offset + length])
+            if info & 0xFF == REC_RX:
+                frames.extend(splitFrames(self.recTime[i], data))
+            else:
+                frames.append((self.recTime[i], info & 0xFF, data))
+        # TX frames transmitted while parsing the received data are recorded before it, with a later time
+        frames.sort(key=itemgetter(0))
+        return frames
+
+
+def splitFrames(t, data):
+    """Return the frames in data, received at monotonic time t, as decode() finds them: [(t, REC_RX or REC_RX_ERROR, frame bytes)]."""
+    frames = []
+    idx = 0
+    end = len(data)
+    while end - idx >= dbc.FRAME_LEN_MIN:
+        frameError, _, frameLen = codec.checkFrame(data, idx, end)
+        if frameError == codec.FRAME_OK:
+            frames.append((t, REC_RX, data[idx : idx + frameLen]))
+            idx += frameLen
+            continue
+        if frameError == codec.FRAME_ERR_INCOMPLETE:
+            break
+        if frameError == codec.FRAME_ERR_CHECKSUM:
+            frames.append((t, REC_RX_ERROR, data[idx : idx + frameLen]))
+        # skip the current byte and seek for the next preamble, like decode()
+        positions = [
+            p for p in (data.find(dbc.PREAMBLE, idx + 1), data.find(dbc.PREAMBLE_DEVICE, idx + 1)) if p >= 0
+        ]
+        idx = min(positions) if positions else end
+    return frames
+
+
+def snapshotLines(frames, now=None, wallNow=None):
+    """Return the frames returned by FlightRecorder.snapshot() in readable form, one string per frame.
+
+    Monotonic timestamps are converted to local time using now=time.monotonic() and wallNow=time.time(),
+    both read when the snapshot was taken.
+    """
+    if now is None:
+        now = monotonic()
+    if wallNow is None:
+        wallNow = time.time()
+    lines = []
+    for t, direction, frame in frames:
+        wall = wallNow - (now - t)
+        protocol = 1 if frame[0] in (dbc.PREAMBLE_DEVICE, dbc.PREAMBLE_MASTER) else 2
+        text, _ = codec.frameText(protocol, frame, len(frame))
+        lines.append(
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall))}.{int(wall * 1000) % 1000:03d}"
+            f" {REC_NAMES[direction]:6s} {text}"
+        )
+    return lines
+
+
+def snapshotWrite(filename, header, lines):
+    """Write header and lines to filename: called in the executor."""
+    with open(filename, "w", encoding="utf-8") as fd:
+        fd.write(header + "\n")
+        for line in lines:
+            fd.write(line + "\n")
@@ -0,0 +1,74 @@
+"""Compact records used by the hub to track DomBus modules and their tx queues.
+
+This module does not depend on Home Assistant, so it can be used by tools and benchmarks.
+"""
+
+from . import creasol_dombus_const as dbc
+
+
+class ModuleState:
+    """State of a DomBus module, in modules[frameAddr]."""
+
+    __slots__ = (
+        "lastRx",  # sec: time of the last frame received from the module
+        "lastTx",  # ms: time of the last frame transmitted to the module (0 => transmit now)
+        "lastStatus",  # sec: time of the last periodic output status
+        "protocol",  # 0=unknown, 1=old protocol, 2=new protocol
+        "retry",  # number of retries (0,1,2,3...): used to compute the retry period
+        "lastConfig",  # used to limit the configuration request to modules partially configured
+        "nextDue",  # ms: earliest deadline (retry, periodic status, alive check) in the tx scheduler heap
+        "statusQueued",  # True if the module is waiting in statusQueue to transmit the periodic output status
+    )
+
+    def __init__(self, lastRx, lastTx, lastStatus, protocol):
+        """Initialize the module state."""
+        self.lastRx = lastRx
+        self.lastTx = lastTx
+        self.lastStatus = lastStatus
+        self.protocol = protocol
+        self.retry = 0
+        self.lastConfig = 0
+        self.nextDue = dbc.TX_DUE_NEVER  # not in the tx scheduler heap
+        self.statusQueued = False
+
+    def __repr__(self):
+        """Return a readable representation, used in logs."""
+        return (
+            f"ModuleState(lastRx={self.lastRx}, lastTx={self.lastTx}, lastStatus={self.lastStatus}, "
+            f"protocol={self.protocol}, retry={self.retry}, lastConfig={self.lastConfig}, nextDue={self.nextDue}, "
+            f"statusQueued={self.statusQueued})"
+        )
+
+
+class TxCommand:
+    """Command in the tx queue of a module, in txQueue[frameAddr][txQueueKey(cmd, cmdLen, port)]."""
+
+    __slots__ = (
+        "cmd",
+        "cmdLen",  # length of data after command (port+args[])
+        "cmdAck",
+        "port",
+        "args",  # sequence of cmdLen-1 bytes: tuple or list
+        "retries",  # number of transmissions left (ACKs are transmitted once)
+        "enqueueTime",  # monotonic time when the command was queued, 0 if not traced (ACKs, commands transmitted once)
+        "txTimes",  # monotonic time of each transmission of a traced command, None before the first one
+    )
+
+    def __init__(self, cmd, cmdLen, cmdAck, port, args, retries, enqueueTime=0.0):
+        """Initialize the command."""
+        self.cmd = cmd
+        self.cmdLen = cmdLen
+        self.cmdAck = cmdAck
+        self.port = port
+        self.args = args
+        self.retries = retries
+        self.enqueueTime = enqueueTime
+        self.txTimes = None
+
+    def __repr__(self):
+        """Return a readable representation, used in logs."""
+        return (
+            f"TxCommand(cmd=0x{self.cmd:02x}, cmdLen={self.cmdLen}, cmdAck=0x{self.cmdAck:02x}, "
+            f"port={self.port}, args={list(self.args)}, retries={self.retries}, "
+            f"transmissions={len(self.txTimes) if self.txTimes else 0})"
+        )
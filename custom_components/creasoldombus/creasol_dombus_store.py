@@ -0,0 +1,304 @@
+"""Write-behind json store used to save DomBus configuration without blocking the event loop.
+
+Small changes are appended to a journal file (filename.journal), one json entry [op, path, value]
+per line, and replayed by load(). When the journal grows over JOURNAL_COMPACT_SIZE bytes the
+whole object is written to filename (snapshot) in background, and the journal is removed.
+
+This module does not depend on Home Assistant: the executor is passed by the caller
+(hass.async_add_executor_job inside Home Assistant, loop.run_in_executor elsewhere).
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+STORE_WRITE_DELAY = 10  # seconds: changes within this time are coalesced in a single write
+STORE_SERIALIZE_RETRY = 5  # max attempts to serialize data modified by the event loop meanwhile
+JOURNAL_WRITE_DELAY = 1  # seconds: journal entries within this time are appended by a single write
+JOURNAL_COMPACT_SIZE = 65536  # bytes: when the journal is bigger, write a new snapshot and remove the journal
+
+JOURNAL_SET = "set"  # [JOURNAL_SET, path, value]: set data[path[0]][path[1]]...=value
+JOURNAL_DEL = "del"  # [JOURNAL_DEL, path, None]: remove data[path[0]][path[1]]...
+
+
+def fileRead(filename):
+    """Return the content of filename: called in the executor."""
+    with open(filename, encoding="utf-8") as fd:
+        return fd.read()
+
+
+def fileWriteAtomic(filename, text):
+    """Write text to filename through a temporary file, so filename is never truncated: called in the executor."""
+    tmpfilename = filename + ".tmp"
+    with open(tmpfilename, "w", encoding="utf-8") as fd:
+        fd.write(text)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmpfilename, filename)
+
+
+def fileRemove(filename):
+    """Remove filename, if exists: called in the executor."""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def journalRead(filename):
+    """Return the lines of the old journal (left by an interrupted compaction) and the journal: called in the executor."""
+    lines = []
+    for name in (filename + ".old", filename):
+        try:
+            with open(name, encoding="utf-8") as fd:
+                lines.extend(fd.readlines())
+        except FileNotFoundError:
+            pass
+    return lines
+
+
+def journalAppend(filename, text):
+    """Append text to the journal and return the journal size: called in the executor."""
+    with open(filename, "a", encoding="utf-8") as fd:
+        fd.write(text)
+        fd.flush()
+        os.fsync(fd.fileno())
+        return fd.tell()
+
+
+def journalRotate(filename):
+    """Move the journal to filename.old, before writing a snapshot: called in the executor."""
+    if not os.path.exists(filename + ".old"):
+        try:
+            os.replace(filename, filename + ".old")
+        except FileNotFoundError:
+            pass
+        return
+    # filename.old left by an interrupted compaction: keep its entries, in order
+    try:
+        with open(filename, encoding="utf-8") as fd:
+            text = fd.read()
+    except FileNotFoundError:
+        return
+    journalAppend(filename + ".old", text)
+    os.remove(filename)
+
+
+def journalApply(data, entry):
+    """Apply a journal entry [op, path, value] to data: return False if entry is not valid."""
+    try:
+        op, path, value = entry
+        obj = data
+        for key in path[:-1]:
+            obj = obj[key] if isinstance(obj, list) else obj.setdefault(key, {})
+        if op == JOURNAL_SET:
+            obj[path[-1]] = value
+        elif op == JOURNAL_DEL:
+            if isinstance(obj, list):
+                del obj[path[-1]]
+            else:
+                obj.pop(path[-1], None)
+        else:
+            return False
+    except (IndexError, KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+class DomBusStore:
+    """Json file written in background, some seconds after the last change.
+
+    getData() returns the object to save; it is serialized in the executor, and the
+    file is written only if the serialized text differs from the one on disk.
+    """
+
+    def __init__(
+        self, filename, getData, executor=None, loop=None, delay=STORE_WRITE_DELAY, **dumpArgs
+    ):
+        """Initialize the store: nothing is read or written until load() or schedule() are called."""
+        self.filename = filename
+        self._getData = getData
+        self._loop = loop if loop else asyncio.get_event_loop()
+        self._executor = (
+            executor
+            if executor
+            else lambda func, *args: self._loop.run_in_executor(None, func, *args)
+        )
+        self._delay = delay
+        self._dumpArgs = dumpArgs
+        self._lastText = None  # text currently on disk
+        self._handle = None  # TimerHandle of the scheduled write
+        self._task = None  # write in progress
+        self._dirty = False  # data changed while a write was in progress
+        self.writes = 0  # number of files written
+        self.skipped = 0  # number of writes skipped because data did not change
+        self.journalFilename = filename + ".journal"
+        self._journalPending = []  # json lines not yet appended to the journal file
+        self._journalHandle = None  # TimerHandle of the scheduled journal append
+        self._journalTask = None  # journal append in progress
+        self._journalSize = 0  # bytes in the journal file
+        self._lock = asyncio.Lock()  # serialize journal appends and snapshot writes
+
+    async def load(self):
+        """Read the json object from file and replay the journal: return None if nothing has been saved."""
+        data = None
+        try:
+            text = await self._executor(fileRead, self.filename)
+        except FileNotFoundError:
+            pass
+        else:
+            try:
+                data = json.loads(text)
+                self._lastText = text
+            except ValueError:
+                _LOGGER.warning("Error loading json file %s", self.filename)
+        lines = await self._executor(journalRead, self.journalFilename)
+        if lines:
+            if data is None:
+                data = {}
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None  # line truncated by a crash while appending
+                if not journalApply(data, entry):
+                    _LOGGER.warning(
+                        "Invalid entry in %s: %s", self.journalFilename, line.rstrip()
+                    )
+            self._journalSize = sum(len(line) for line in lines)
+            _LOGGER.debug(
+                "Replayed %d entries from %s", len(lines), self.journalFilename
+            )
+            if self._journalSize > JOURNAL_COMPACT_SIZE:
+                self.schedule()  # compact in background
+        return data
+
+    def append(self, op, path, value=None):
+        """Record a change already applied to data: op=JOURNAL_SET or JOURNAL_DEL, path=list of keys."""
+        self._journalPending.append(json.dumps([op, path, value]) + "\n")
+        if self._journalHandle is None and self._journalTask is None:
+            self._journalHandle = self._loop.call_later(
+                JOURNAL_WRITE_DELAY, self._journalStart
+            )
+
+    def _journalStart(self):
+        """Timer callback: start the journal append task."""
+        self._journalHandle = None
+        self._journalTask = self._loop.create_task(self._journalWrite())
+
+    async def _journalWrite(self):
+        """Journal append task: append pending entries, and compact if journal is too big."""
+        try:
+            async with self._lock:
+                if self._journalPending:
+                    lines = self._journalPending
+                    self._journalPending = []
+                    try:
+                        self._journalSize = await self._executor(
+                            journalAppend, self.journalFilename, "".join(lines)
+                        )
+                    except OSError as e:
+                        _LOGGER.error(
+                            "Error writing file %s: %s", self.journalFilename, e
+                        )
+                        self._journalPending[0:0] = lines  # retry later
+        finally:
+            self._journalTask = None
+        if self._journalSize > JOURNAL_COMPACT_SIZE:
+            self.schedule()
+        if self._journalPending and self._journalHandle is None:
+            self._journalHandle = self._loop.call_later(
+                JOURNAL_WRITE_DELAY, self._journalStart
+            )
+
+    def schedule(self):
+        """Schedule writing: bursts of changes result in a single write after `delay` seconds."""
+        if self._task is not None:
+            self._dirty = True  # write again when the current write completes
+        elif self._handle is None:
+            self._handle = self._loop.call_later(self._delay, self._writeStart)
+
+    def _writeStart(self):
+        """Timer callback: start the write task."""
+        self._handle = None
+        self._task = self._loop.create_task(self._write())
+
+    async def _write(self):
+        """Write task: write the file, then write again if data changed meanwhile."""
+        try:
+            await self.writeNow()
+        except OSError as e:
+            _LOGGER.error("Error writing file %s: %s", self.filename, e)
+        finally:
+            self._task = None
+        if self._dirty:
+            self._dirty = False
+            self.schedule()
+
+    def _serialize(self, data):
+        """Return data in json format: called in the executor."""
+        return json.dumps(data, **self._dumpArgs)
+
+    async def writeNow(self):
+        """Write a snapshot (if data changed since the last write) and remove the journal."""
+        async with self._lock:
+            rotated = self._journalSize > 0
+            if rotated:
+                # entries appended from now on go to a new journal, replayed after the snapshot
+                await self._executor(journalRotate, self.journalFilename)
+                self._journalSize = 0
+            # pending entries recorded until now are included in the snapshot
+            journalPending = len(self._journalPending)
+            written = await self._snapshotWrite()
+            del self._journalPending[0:journalPending]
+            if rotated:
+                await self._executor(fileRemove, self.journalFilename + ".old")
+            return written
+
+    async def _snapshotWrite(self):
+        """Serialize in the executor and write the file, if data changed since the last write."""
+        data = self._getData()
+        for _ in range(STORE_SERIALIZE_RETRY):
+            try:
+                text = await self._executor(self._serialize, data)
+                break
+            except RuntimeError:
+                # data has been modified by the event loop while serializing: retry
+                await asyncio.sleep(0)
+        else:
+            text = self._serialize(data)  # last chance: serialize in the event loop
+        if text == self._lastText:
+            self.skipped += 1
+            return False
+        await self._executor(fileWriteAtomic, self.filename, text)
+        self._lastText = text
+        self.writes += 1
+        return True
+
+    @property
+    def pending(self):
+        """Return True if a write is scheduled or in progress."""
+        return (
+            self._handle is not None
+            or self._task is not None
+            or bool(self._journalPending)
+            or self._journalTask is not None
+        )
+
+    async def flush(self):
+        """Write pending changes now, in a new snapshot (used when unloading)."""
+        self._dirty = False
+        if self._journalHandle is not None:
+            self._journalHandle.cancel()
+            self._journalHandle = None
+        if self._journalTask is not None:
+            await self._journalTask
+        if self._task is not None:
+            await self._task
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        await self.writeNow()
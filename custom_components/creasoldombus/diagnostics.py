@@ -0,0 +1,27 @@
+"""Diagnostics support for Creasol DomBus."""
+
+from . import creasol_dombus_const as dbc
+from .const import DOMAIN
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return diagnostics for a config entry (DomBus bus)."""
+    hub = hass.data[DOMAIN]["hub"].get(entry.entry_id)
+    if hub is None:
+        return {}
+    return {
+        "busnum": hub.busNum,
+        "modules": {
+            f"{frameAddr:04x}": {
+                "protocol": module.protocol,
+                "lastRx": module.lastRx,
+                "retry": module.retry,
+                "txQueue": len(hub.txQueue.get(frameAddr, ())),
+            }
+            for frameAddr, module in hub.modules.items()
+        },
+        "rx_latency": hub.rxLatency.summary(),  # bytes received -> entity state written, for each stage
+        "tx_retry_time_ms": dbc.TX_RETRY_TIME,  # first retry after 2*TX_RETRY_TIME, compare with the rtt of each module
+        "commands": hub.commandStatsSummary(),  # rtt, retries and time to ACK of the commands, for each module
+        "recorder": hub.recorderLines(),  # last frames received and transmitted
+    }
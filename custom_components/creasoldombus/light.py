@@ -152,7 +152,8 @@ class DomBusLight(LightEntity):
             1,
         )  # send command to DomBus module
         self._hub.send()  # Transmit
-        self.schedule_update_ha_state()
+        self.async_write_ha_state()
+        self._hub.stateWritten()
 
     async def async_turn_off(self):
         """Set _state to False."""
@@ -161,4 +162,5 @@ class DomBusLight(LightEntity):
             0, self._frameAddr, dbc.CMD_SET, 2, 0, self._port, [0], dbc.TX_RETRY, 1
         )  # send command to DomBus module
         self._hub.send()  # Transmit
-        self.schedule_update_ha_state()
+        self.async_write_ha_state()
+        self._hub.stateWritten()
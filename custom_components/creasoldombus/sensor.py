@@ -66,13 +66,13 @@ class DomBusSensor(RestoreEntity, SensorEntity):
         (self._porttype, self._portopt, self._descr) = porttype_list
         if opts_dict is not None:
             if "value" in opts_dict:
-                self.state = opts_dict["value"]
+                self._attr_state = opts_dict["value"]
             if "entityClass" in opts_dict:
-                self.device_class = opts_dict["entityClass"]
+                self._attr_device_class = opts_dict["entityClass"]
             if "entityIcon" in opts_dict:
-                self.icon = opts_dict["entityIcon"]
+                self._attr_icon = opts_dict["entityIcon"]
             if "entityUOM" in opts_dict:
-                self.unit_of_measurement = opts_dict["entityUOM"]
+                self._attr_native_unit_of_measurement = opts_dict["entityUOM"]
             if "opposite" in opts_dict:
                 self._opposite = opts_dict["opposite"]
         self._assumed = False
@@ -143,3 +143,4 @@ class DomBusSensor(RestoreEntity, SensorEntity):
         if value != self.state:
             self._attr_state = value
             self.async_write_ha_state()
+            self._hub.stateWritten()
@@ -117,24 +117,34 @@ class DomBusSwitch(SwitchEntity):
         """Return the porttype."""
         return self._porttype
 
+    async def async_turn_on(self, **kwargs):
+        """Turn the switch on from Home Assistant: runs in the event loop, like the hub tx scheduler."""
+        self.turn_on(**kwargs)
+
+    async def async_turn_off(self, **kwargs):
+        """Turn the switch off from Home Assistant: runs in the event loop, like the hub tx scheduler."""
+        self.turn_off(**kwargs)
+
     def turn_on(self, **kwargs):
-        """Turn the switch on."""
+        """Turn the switch on: called in the event loop by async_turn_on() and by the hub rx handlers."""
         _LOGGER.debug("Turn ON switch")
         self._state = True
+        self.async_write_ha_state()  # write the state before queuing the command
+        self._hub.stateWritten()
         # self._hub.txQueueAddComplete(protocol, frameAddr, cmd, cmdLen, cmdAck, port, args, retries=1, now=1) # send command to DomBus module
         self._hub.txQueueAddComplete(
             0, self._frameAddr, dbc.CMD_SET, 2, 0, self._port, [1], dbc.TX_RETRY, 1
         )  # send command to DomBus module
         self._hub.send()  # Transmit
-        self.schedule_update_ha_state()
         _LOGGER.info("Entity=%s", self)
 
     def turn_off(self, **kwargs):
-        """Turn the device off."""
+        """Turn the device off: called in the event loop by async_turn_off() and by the hub rx handlers."""
         _LOGGER.debug("Turn OFF switch")
         self._state = False
+        self.async_write_ha_state()  # write the state before queuing the command
+        self._hub.stateWritten()
         self._hub.txQueueAddComplete(
             0, self._frameAddr, dbc.CMD_SET, 2, 0, self._port, [0], dbc.TX_RETRY, 1
         )  # send command to DomBus module
-        self.schedule_update_ha_state()
         self._hub.send()  # Transmit
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""End-to-end bus benchmark: frames through data_received, decode, parseFrame, entity update and send.
+
+DomBusHubCore runs without Home Assistant, with entities kept in memory (MemorySink) and an in-memory
+transport that counts the transmitted frames; frames are built in advance by the simulated modules of
+tools/dombus_simulator.py and fed to DomBusProtocol.data_received() in a tight loop. Scenarios:
+- steady: status frames (inputs and sensors) from already discovered modules;
+- discovery: 100 unknown modules send a status, get the configuration request, reply with their
+  port table, then send a status for the new entities;
+- storm: commands to outputs (turn_on/turn_off, like the switch and light entities), each ACKed by the module;
+- noisy: steady traffic with wrong checksums and garbage bytes, received in random chunks (flight recorder started).
+Before measuring, the modules reply to the configuration requests and ACK the output status, so
+steady traffic only transmits ACKs to the status frames, if enabled (--tx-ack, default TXACK_ENABLE).
+
+For each scenario the benchmark reports RX frames/s, TX frames/s, CPU per RX frame and the latency from
+data_received() to each entity state change (p50/p99); in storm the state is changed by the command,
+and the latency from the command to the frame transmission is also reported. Each scenario runs --repeat times and the run with the lowest CPU per frame
+is kept. Results can be saved as a JSON baseline (--save) and compared with a previous one (--compare):
+the exit status is 1 if a metric is worse than the baseline by more than --tolerance.
+
+Usage: tools/bench_bus.py [--scenario steady] [--frames 20000] [--repeat 3] [--save FILE] [--compare FILE]
+Baseline: tools/baselines/bench_bus.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import platform
+import random
+import sys
+import tempfile
+import time
+from time import perf_counter_ns
+import types
+
+from dombus_path import dombus
+import dombus_simulator as sim
+
+codec = dombus("creasol_dombus_codec")
+dbc = dombus("creasol_dombus_const")
+hub = dombus("creasol_dombus_hub")
+
+BASELINE_VERSION = 1
+DISCOVER_TIMEOUT = 5  # seconds to wait for the queued commands to be transmitted and ACKed
+# metrics compared with the baseline: True if higher is better
+METRICS = {
+    "rx_fps": True,
+    "cpu_us_per_frame": False,
+    "latency_p50_us": False,
+    "latency_p99_us": False,
+}
+
+
+class MemoryTransport(asyncio.Transport):
+    """Transport that counts the frames written by the protocol, and the time of the last one."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        super().__init__()
+        self.frames = 0
+        self.bytes = 0
+        self.lastWrite = 0  # perf_counter_ns() of the last write
+        self.written = None  # list of the frames written, if not None
+
+    def write(self, data):
+        """Count the frame."""
+        self.frames += 1
+        self.bytes += len(data)
+        self.lastWrite = perf_counter_ns()
+        if self.written is not None:
+            self.written.append(bytes(data))
+
+    def is_closing(self):
+        """Return False: the transport is never closed."""
+        return False
+
+    def close(self):
+        """Do nothing: there is no connection to close."""
+
+
+class LatencyEntity(hub.MemoryEntity):
+    """MemoryEntity that records the time from data_received() to each state change."""
+
+    def stateWritten(self):
+        """Count the state change and record its latency."""
+        super().stateWritten()
+        sink = self._hub.sink
+        sink.latency.append(perf_counter_ns() - sink.rxStart)
+
+
+class LatencySink(hub.MemorySink):
+    """MemorySink that creates LatencyEntity entities."""
+
+    def __init__(self):
+        """Initialize the sink."""
+        super().__init__()
+        self.rxStart = 0  # perf_counter_ns() when the current data has been received
+        self.latency = []  # ns from data_received() to the state change
+
+    def createEntity(self, hub, entityConfig):
+        """Return a new LatencyEntity."""
+        return LatencyEntity(hub, *entityConfig)
+
+
+class Bench:
+    """Hub connected to an in-memory transport, with simulated modules."""
+
+    def __init__(self, configDir, modules, ports, txAck=dbc.TXACK_ENABLE, firstAddr=0xFF01):
+        """Create the hub and the modules: modules are not discovered yet."""
+        self.sink = LatencySink()
+        self.hub = hub.DomBusHubCore(1, self.sink, configDir=configDir)
+        self.hub.rxEnabled = True
+        self.hub.txAckEnabled = txAck
+        self.transport = MemoryTransport()
+        # the tx and heartbeat tasks are not started: parseFrame() calls send() for each frame
+        self.protocol = self.hub.newProtocol()
+        self.protocol.connection_made(self.transport)
+        # Module.receive() only needs the simulator counters
+        bus = types.SimpleNamespace(stats=collections.Counter(), latency=[])
+        self.modules = [
+            sim.Module(bus, addr, 2, ports, False)
+            for addr in range(firstAddr, firstAddr + modules)
+        ]
+
+    def statusFrame(self, module, ports):
+        """Return a frame from module with the status of ports, toggling digital inputs."""
+        commands = []
+        for port in ports:
+            if module.ports[port - 1][1] == 1:
+                module.values[port] ^= 1
+            commands.append(sim.command(2, dbc.CMD_SET, 0, port, module.value(port)))
+        return sim.deviceFrame(2, module.addr, commands)
+
+    def statusFrames(self, count):
+        """Return count status frames, from all modules in turn, each with up to STATUS_COMMANDS inputs."""
+        frames = []
+        inputs = [module.inputs() for module in self.modules]
+        for n in range(count):
+            i = n % len(self.modules)
+            ports = inputs[i]
+            start = (n // len(self.modules)) * sim.STATUS_COMMANDS % max(1, len(ports))
+            frames.append(
+                self.statusFrame(
+                    self.modules[i], (ports + ports)[start : start + sim.STATUS_COMMANDS]
+                )
+            )
+        return frames
+
+    def configFrames(self):
+        """Return the configuration reply of each module."""
+        return [sim.deviceFrame(2, m.addr, [m.configReply()]) for m in self.modules]
+
+    def discover(self):
+        """Discover all modules, without measuring: status, then the replies of the modules until the hub stops transmitting."""
+        modules = {m.addr: m for m in self.modules}
+        self.transport.written = []
+        self.feed(self.statusFrames(len(self.modules)))
+        end = time.monotonic() + DISCOVER_TIMEOUT
+        while time.monotonic() < end:
+            if not self.transport.written:
+                if not any(self.hub.txQueue.values()):
+                    break
+                time.sleep(0.02)  # commands that did not fit in a frame: wait for the retry time
+                self.hub.send()
+                continue
+            written = self.transport.written
+            self.transport.written = []
+            for frame in written:
+                _, _, decoded = codec.decodeFrame(frame)
+                module = modules.get(decoded.dstAddr) if decoded else None
+                if module is not None:
+                    replies = module.receive(decoded.commands)
+                    if replies:
+                        self.feed((sim.deviceFrame(2, module.addr, replies),))
+        self.transport.written = None
+        self.sink.latency.clear()
+
+    def feed(self, chunks):
+        """Feed chunks to data_received(), recording the time each one arrives."""
+        sink = self.sink
+        protocol = self.protocol
+        for chunk in chunks:
+            sink.rxStart = perf_counter_ns()
+            protocol.data_received(chunk)
+
+
+class Measure:
+    """Wall time, CPU time, TX frames and state changes of a benchmark run."""
+
+    def __init__(self, bench):
+        """Start measuring."""
+        self.bench = bench
+        self.tx = bench.transport.frames
+        self.writes = bench.sink.writes
+        bench.sink.latency.clear()
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+
+    def result(self, rxFrames, **extra):
+        """Stop measuring and return the results."""
+        elapsed = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        bench = self.bench
+        txFrames = bench.transport.frames - self.tx
+        latency = sorted(bench.sink.latency)
+        result = {
+            "rx_frames": rxFrames,
+            "seconds": round(elapsed, 4),
+            "rx_fps": round(rxFrames / elapsed),
+            "tx_frames": txFrames,
+            "tx_fps": round(txFrames / elapsed),
+            "state_writes": bench.sink.writes - self.writes,
+            "cpu_us_per_frame": round(cpu * 1e6 / max(1, rxFrames), 2),
+            "latency_p50_us": round(percentile(latency, 50) / 1000, 2),
+            "latency_p99_us": round(percentile(latency, 99) / 1000, 2),
+        }
+        result.update(extra)
+        return result
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the sorted list values (0 if empty)."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def steady(args, configDir):
+    """Status frames from discovered modules."""
+    bench = Bench(configDir, args.modules, args.ports, args.tx_ack)
+    bench.discover()
+    frames = bench.statusFrames(args.frames)
+    measure = Measure(bench)
+    bench.feed(frames)
+    return measure.result(len(frames))
+
+
+def discovery(args, configDir):
+    """Unknown modules: status, configuration request and reply, status of the new entities."""
+    bench = Bench(configDir, args.discovery_modules, args.ports, args.tx_ack)
+    frames = bench.statusFrames(len(bench.modules))
+    configs = bench.configFrames()
+    status = bench.statusFrames(len(bench.modules))
+    measure = Measure(bench)
+    bench.feed(frames)
+    bench.feed(configs)
+    discoveryTime = time.perf_counter() - measure.start
+    bench.feed(status)
+    return measure.result(
+        len(frames) + len(configs) + len(status),
+        entities=len(bench.sink.entities),
+        discovery_ms=round(discoveryTime * 1000, 2),
+    )
+
+
+def storm(args, configDir):
+    """Commands to outputs, each one ACKed by the module."""
+    bench = Bench(configDir, args.modules, args.ports, args.tx_ack)
+    bench.discover()
+    outputs = [
+        e for e in bench.sink.entities.values() if e.platform in ("switch", "light")
+    ]
+    commands = []  # (entity, on, ACK frame)
+    for n in range(args.frames):
+        entity = outputs[n % len(outputs)]
+        on = (n // len(outputs)) & 1 == 0
+        ack = sim.command(2, dbc.CMD_SET, dbc.CMD_ACK, entity._port, bytes((1 if on else 0,)))
+        commands.append(
+            (entity, on, sim.deviceFrame(2, entity._frameAddr, [ack]))
+        )
+    transport = bench.transport
+    sink = bench.sink
+    protocol = bench.protocol
+    cmdLatency = []
+    measure = Measure(bench)
+    for entity, on, ack in commands:
+        tx = transport.frames
+        start = sink.rxStart = perf_counter_ns()  # the state is written by turn_on()/turn_off()
+        if on:
+            entity.turn_on()
+        else:
+            entity.turn_off()
+        if transport.frames != tx:
+            cmdLatency.append(transport.lastWrite - start)
+        sink.rxStart = perf_counter_ns()
+        protocol.data_received(ack)
+    cmdLatency.sort()
+    elapsed = time.perf_counter() - measure.start
+    return measure.result(
+        len(commands),
+        commands_per_s=round(len(commands) / elapsed),
+        cmd_to_tx_p50_us=round(percentile(cmdLatency, 50) / 1000, 2),
+        cmd_to_tx_p99_us=round(percentile(cmdLatency, 99) / 1000, 2),
+    )
+
+
+def noisy(args, configDir):
+    """Status frames with wrong checksums and garbage bytes, received in random chunks."""
+    bench = Bench(configDir, args.modules, args.ports, args.tx_ack)
+    bench.discover()
+    rnd = random.Random(args.seed)
+    stream = bytearray()
+    corrupted = 0
+    for frame in bench.statusFrames(args.frames):
+        if rnd.random() < args.garbage_rate:
+            stream += bytes(rnd.randrange(256) for _ in range(rnd.randint(1, 8)))
+        if rnd.random() < args.error_rate:
+            frame = frame[:-1] + bytes(((frame[-1] + 1) & 0xFF,))
+            corrupted += 1
+        stream += frame
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, args.chunk_max)
+        chunks.append(bytes(stream[pos : pos + size]))
+        pos += size
+    errors = [0]
+    bench.hub.recorderStart()  # checksum errors are counted by the flight recorder
+    checksumError = bench.hub.recorder.checksumError
+
+    def countError():
+        errors[0] += 1
+        checksumError()
+
+    bench.hub.recorder.checksumError = countError
+    measure = Measure(bench)
+    bench.feed(chunks)
+    return measure.result(
+        args.frames,
+        corrupted=corrupted,
+        checksum_errors=errors[0],
+        chunks=len(chunks),
+    )
+
+
+SCENARIOS = {
+    "steady": steady,
+    "discovery": discovery,
+    "storm": storm,
+    "noisy": noisy,
+}
+
+
+async def run(args):
+    """Run the selected scenarios: return {scenario: result}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as configDir:
+        for name in args.scenario or SCENARIOS:
+            runs = [SCENARIOS[name](args, configDir) for _ in range(args.repeat)]
+            results[name] = min(runs, key=lambda r: r["cpu_us_per_frame"])
+            await asyncio.sleep(0.1)  # let the flight recorder triggered by the noisy line write its file
+    return results
+
+
+def compare(results, baseline, tolerance, metrics=METRICS):
+    """Print the changes of metrics compared with the baseline: return the number of regressions."""
+    regressions = 0
+    for name, result in results.items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        for metric, higherIsBetter in metrics.items():
+            old = base.get(metric)
+            new = result.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            worse = -change if higherIsBetter else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            regressions += bool(flag)
+            print(f"{name:10s} {metric:18s} {old:>12} -> {new:>12} {change * 100:+6.1f}% {flag}")
+    return regressions
+
+
+def main():
+    """Parse the command line, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=20000, help="frames (storm: commands) for each run")
+    parser.add_argument("--modules", type=int, default=50)
+    parser.add_argument("--discovery-modules", type=int, default=100)
+    parser.add_argument("--ports", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--tx-ack",
+        action=argparse.BooleanOptionalAction,
+        default=dbc.TXACK_ENABLE,
+        help="ACK the status frames received from modules (default: TXACK_ENABLE)",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.05, help="noisy: frames with wrong checksum")
+    parser.add_argument("--garbage-rate", type=float, default=0.05, help="noisy: frames preceded by garbage")
+    parser.add_argument("--chunk-max", type=int, default=64, help="noisy: max bytes for each data_received()")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(args.seed)  # sensor values of the simulated modules
+
+    results = asyncio.run(run(args))
+    for name, result in results.items():
+        print(
+            f"{name:10s} rx {result['rx_fps']:8d} frames/s  tx {result['tx_fps']:8d} frames/s"
+            f"  cpu {result['cpu_us_per_frame']:7.2f} us/frame"
+            f"  latency p50 {result['latency_p50_us']:7.2f} us  p99 {result['latency_p99_us']:7.2f} us"
+        )
+    if args.save:
+        baseline = {
+            "version": BASELINE_VERSION,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+            "scenarios": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as fd:
+            json.dump(baseline, fd, indent=2)
+            fd.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fd:
+            baseline = json.load(fd)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""RX checksum benchmark: per-frame cost of the checksum and of checkFrame().
+
+Frames: 31 bytes (FRAME_LEN_MAX, the longest frame transmitted to modules) and 150 bytes
+(typical reply to the full port configuration request). The old Python loop is compared
+with the builtin sum() over a memoryview slice used by creasol_dombus_codec.checksum().
+
+Usage: tools/bench_checksum.py [--number 200000]
+"""
+
+import argparse
+import timeit
+
+from dombus_path import dombus
+
+codec = dombus("creasol_dombus_codec")
+dbc = dombus("creasol_dombus_const")
+
+
+def checksumLoop(buffer, start, length):
+    """Old checksum: Python loop."""
+    value = 0
+    for i in range(start, start + length):
+        value += buffer[i]
+    return value & 0xFF
+
+
+def frame(length):
+    """Return a valid protocol 2 frame with length bytes, in a bytearray preceded by some noise."""
+    payload = bytes((i * 7) & 0xFF for i in range(length - dbc.FRAME_HEADER2 - 1))
+    data = bytearray(b"\x00\x55")  # noise, as rxbuffer during resync
+    start = len(data)
+    data += codec.HEADER2.pack(dbc.PREAMBLE, 0, 0x1234, len(payload)) + payload
+    data.append(sum(data[start:]) & 0xFF)
+    return data, start
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+    n = args.number
+
+    for length in (dbc.FRAME_LEN_MAX, 150):
+        data, start = frame(length)
+        view = memoryview(data).toreadonly()
+        end = len(data)
+        assert codec.checkFrame(view, start, end) == (codec.FRAME_OK, 2, length)
+        assert checksumLoop(data, start, length - 1) == codec.checksum(
+            view, start, length - 1
+        )
+        tLoop = min(
+            timeit.repeat(lambda: checksumLoop(data, start, length - 1), number=n, repeat=3)
+        )
+        tSum = min(
+            timeit.repeat(
+                lambda: codec.checksum(view, start, length - 1), number=n, repeat=3
+            )
+        )
+        tCheck = min(
+            timeit.repeat(lambda: codec.checkFrame(view, start, end), number=n, repeat=3)
+        )
+        print(
+            f"{length:3d} bytes: loop={tLoop * 1e9 / n:6.0f} ns  sum(memoryview)={tSum * 1e9 / n:5.0f} ns"
+            f"  ({tLoop / tSum:4.1f}x)  checkFrame={tCheck * 1e9 / n:5.0f} ns"
+        )
+        view.release()
+
+
+if __name__ == "__main__":
+    main()
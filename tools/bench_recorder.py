@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Flight recorder benchmark: cost of recording frames in DomBusProtocol.decode().
+
+Status frames from 100 modules are decoded with and without a FlightRecorder, with a parseFrame()
+that does nothing, so the difference is the cost of record(). Frames are received in two ways:
+burst (all the frames in a single data_received() call) and frame (one data_received() for each frame,
+the worst case: the recorder records all the data decoded by each decode() call).
+
+Usage: tools/bench_recorder.py [--frames 1000] [--number 200]
+"""
+
+import argparse
+import timeit
+
+from dombus_path import dombus
+
+codec = dombus("creasol_dombus_codec")
+dbc = dombus("creasol_dombus_const")
+protocol = dombus("creasol_dombus")
+recorder = dombus("creasol_dombus_recorder")
+
+
+def statusFrames(frames):
+    """Return a list of frames status frames (protocol 2, SET of 2 ports) from 100 modules."""
+    return [
+        bytes(
+            codec.encodeFrame(
+                2,
+                0,
+                [(dbc.CMD_SET, 2, 0, 1, (i & 1,)), (dbc.CMD_SET, 3, 0, 2, (0, i & 0xFF))],
+                srcAddr=0xFF00 + i % 100,
+            )
+        )
+        for i in range(frames)
+    ]
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    frames = statusFrames(args.frames)
+    burst = b"".join(frames)
+    for mode in ("burst", "frame"):
+        results = {}
+        for name, flightRecorder in (("none", None), ("recorder", recorder.FlightRecorder())):
+            proto = protocol.DomBusProtocol(lambda *a: None, flightRecorder)
+
+            if mode == "burst":
+
+                def run():
+                    proto.data_received(burst)
+
+            else:
+
+                def run():
+                    for frame in frames:
+                        proto.data_received(frame)
+
+            results[name] = min(timeit.repeat(run, number=args.number, repeat=3))
+            print(
+                f"{mode:5s} {name:9s} {results[name] * 1e9 / (args.number * args.frames):6.0f} ns/frame"
+            )
+        print(
+            f"{mode:5s} record() overhead: "
+            f"{(results['recorder'] - results['none']) * 1e9 / (args.number * args.frames):.0f} ns/frame"
+            f" ({100 * (results['recorder'] / results['none'] - 1):.0f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Registration benchmark: startup time to register the saved entities, one by one or in a single batch.
+
+The saved configuration of modules x ports entities (default 47 x 32 = 1504, as built by rxConfigReply())
+is registered in a new DomBusHubCore with a MemorySink, in two ways:
+- entity: registerEntity() for each entity, as the integration did before registerEntities(): one
+  addEntities() call and one WARNING log line ("Platform ok") for each entity;
+- batch: a single registerEntities() call, as configFileInit() does at startup.
+Logging is configured as Home Assistant by default (WARNING level), with records written to /dev/null.
+MemorySink.addEntities() does nothing, so the cost of each async_add_entities() call in Home Assistant
+(entity platform, tasks and entity registry) is not included: the real saving is bigger.
+
+Usage: tools/bench_register.py [--modules 47] [--ports 32] [--repeat 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from bench_scale import entityConfigs
+from dombus_path import dombus
+
+hub = dombus("creasol_dombus_hub")
+
+_LOGGER = logging.getLogger(hub.__name__)
+
+
+class LoggingSink(hub.MemorySink):
+    """MemorySink that logs each addEntities() call, as the integration did for each entity."""
+
+    def addEntities(self, entities):
+        """Add the entities, logging the platform of the first one."""
+        _LOGGER.warning("Platform ok: %s. Now async_add_entity()", entities[0].platform)
+        super().addEntities(entities)
+
+
+def register(configs, mode):
+    """Register the entities in a new hub: return the elapsed time in seconds."""
+    devices = {entityConfig[0]: entityConfig for entityConfig in configs}  # saved config, as at startup
+    if mode == "entity":
+        dombusHub = hub.DomBusHubCore(1, LoggingSink(), devices=devices)
+        start = time.perf_counter()
+        for entityConfig in configs:
+            dombusHub.registerEntity(entityConfig)
+    else:
+        dombusHub = hub.DomBusHubCore(1, hub.MemorySink(), devices=devices)
+        start = time.perf_counter()
+        dombusHub.registerEntities(configs)
+    elapsed = time.perf_counter() - start
+    assert len(dombusHub.entities) == len(configs)
+    return elapsed
+
+
+async def run(args):
+    """Register the entities args.repeat times for each mode, interleaved: return {mode: best time}."""
+    configs = list(entityConfigs(args.modules, args.ports).values())
+    results = {"entity": [], "batch": []}
+    for _ in range(args.repeat):
+        for mode, times in results.items():
+            times.append(register(configs, mode))
+    return len(configs), {mode: min(times) for mode, times in results.items()}
+
+
+def main():
+    """Parse the command line, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, default=47)
+    parser.add_argument("--ports", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=20, help="runs for each mode: the best one is reported")
+    args = parser.parse_args()
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        logging.basicConfig(level=logging.WARNING, stream=devnull)
+        entities, results = asyncio.run(run(args))
+    for mode, elapsed in results.items():
+        print(f"{mode:6s} {entities} entities in {elapsed * 1000:7.2f} ms ({elapsed * 1e6 / entities:.2f} us/entity)")
+    print(f"batch/entity: {results['batch'] / results['entity']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
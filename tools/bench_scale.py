@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Scale benchmark: startup time, memory and tx scheduler cost with up to 300 modules x 32 ports.
+
+For each number of modules (--modules 50,100,200,300) a saved config file is synthesized, with one entity
+for each port as created by rxConfigReply(), and loaded as configFileInit() does: DomBusStore.load(),
+configDataInit(), then DomBusHubCore.registerEntities() with entities kept in memory (MemorySink).
+The load is measured twice: without tracemalloc for the wall time of each phase, and with tracemalloc
+for the peak and the bytes per entity (config dict, hub port tables and MemoryEntity: Home Assistant
+entity objects are not included). maxrss is the peak RSS of the whole process.
+
+Then each module transmits a status frame, so that all modules are tracked by the hub, and the benchmark
+measures:
+- send() when nothing is due (called for each frame received);
+- send() transmitting a command queued for one module;
+- heartbeat() (lastConfig countdown for all modules);
+- a periodic refresh pass: all modules with the output status due, calling send() until the status of
+  every module has been queued and transmitted (STATUS_TX_INTERVAL is considered elapsed before each call);
+- status pacing: all modules with the output status due, calling send() in a busy loop for PACING_TIME
+  seconds: fails (exit code 1) if more than one output status is transmitted every STATUS_TX_INTERVAL ms.
+
+Usage: tools/bench_scale.py [--modules 50,100,200,300] [--ports 32] [--save FILE] [--compare FILE]
+Baseline: tools/baselines/bench_scale.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import types
+
+from bench_bus import MemoryTransport, compare
+from dombus_path import dombus
+import dombus_simulator as sim
+
+const = dombus("const")
+dbc = dombus("creasol_dombus_const")
+hub = dombus("creasol_dombus_hub")
+store = dombus("creasol_dombus_store")
+
+BASELINE_VERSION = 1
+ENTRY_ID = "0123456789abcdef0123456789abcdef"  # config entry of the bus
+PACING_TIME = 0.5  # seconds: duration of the status pacing check
+# metrics compared with the baseline: True if higher is better
+METRICS = {
+    "load_ms": False,
+    "register_ms": False,
+    "bytes_per_entity": False,
+    "send_idle_us": False,
+    "send_tx_us": False,
+    "refresh_pass_ms": False,
+}
+
+
+def entityConfigs(modules, ports, busNum=1, firstAddr=1):
+    """Return the saved configuration of the entities of modules x ports, as built by rxConfigReply()."""
+    devices = {}
+    for frameAddr in range(firstAddr, firstAddr + modules):
+        for port in range(1, ports + 1):
+            portType = sim.PORT_MIX[(frameAddr + port - 1) % len(sim.PORT_MIX)][0]
+            (platform, descr, opts) = hub.PORTTYPE_ENTITY[portType]
+            devID = f"{frameAddr:x}.{port:x}"
+            uniqueID = f"{busNum}_{frameAddr:04x}_{port:02x}"
+            devices[uniqueID] = [
+                uniqueID,
+                [busNum, 2, frameAddr, port, devID, platform],
+                f"[{devID}] IO{port}",
+                [portType, dbc.PORTOPT_NONE, descr],
+                dict(opts),
+            ]
+    return devices
+
+
+def configWrite(filename, modules, ports):
+    """Write the saved config file of a bus with modules x ports entities."""
+    saved = {
+        const.CONF_BUSNUM: {ENTRY_ID: 1, "next": 2},
+        const.CONF_BUSNUMENTRY: {1: ENTRY_ID},
+        hub.CONF_DEVICES: {ENTRY_ID: entityConfigs(modules, ports)},
+    }
+    with open(filename, "w", encoding="utf-8") as fd:
+        json.dump(saved, fd, indent=2, sort_keys=True)  # same format written by DomBusStore
+
+
+async def load(filename, configDir):
+    """Load the config file and register the entities, as async_setup_entry(): return (hub, times in seconds)."""
+    loop = asyncio.get_running_loop()
+    times = {}
+    start = time.perf_counter()
+    data = {}
+    data["store"] = store.DomBusStore(
+        filename,
+        lambda: data[const.CONF_SAVED],
+        lambda func, *args: loop.run_in_executor(None, func, *args),
+        loop,
+        indent=2,
+        sort_keys=True,
+    )
+    data[const.CONF_SAVED] = await data["store"].load()
+    times["load"] = time.perf_counter() - start
+    hub.configDataInit(data, ENTRY_ID)
+    saved = data[const.CONF_SAVED]
+    dombusHub = hub.DomBusHubCore(
+        saved[const.CONF_BUSNUM][ENTRY_ID],
+        hub.MemorySink(),
+        devices=saved[hub.CONF_DEVICES][ENTRY_ID],
+        entities=data[hub.CONF_ENTITIES][ENTRY_ID],
+        configDir=configDir,
+    )
+    times["init"] = time.perf_counter() - start - times["load"]
+    dombusHub.registerEntities(list(saved[hub.CONF_DEVICES][ENTRY_ID].values()))
+    times["register"] = time.perf_counter() - start - times["load"] - times["init"]
+    return dombusHub, times
+
+
+def connect(dombusHub, modules, ports, firstAddr=1):
+    """Connect the hub to an in-memory transport, and receive a status frame from each module."""
+    transport = MemoryTransport()
+    protocol = dombusHub.newProtocol()
+    protocol.connection_made(transport)
+    dombusHub.rxEnabled = True
+    bus = types.SimpleNamespace(stats=collections.Counter(), latency=[])
+    for frameAddr in range(firstAddr, firstAddr + modules):
+        module = sim.Module(bus, frameAddr, 2, ports, False)
+        commands = [
+            sim.command(2, dbc.CMD_SET, 0, port, module.value(port))
+            for port in module.inputs()[: sim.STATUS_COMMANDS]
+        ]
+        protocol.data_received(sim.deviceFrame(2, frameAddr, commands))
+    return transport
+
+
+def quiet(dombusHub):
+    """Empty the tx queues (as if all commands were ACKed) and set every module as just refreshed."""
+    now = int(time.time())
+    dombusHub.txQueue.clear()
+    dombusHub.txHeap.clear()
+    dombusHub.statusQueue.clear()
+    dombusHub.statusNextTx = 0
+    for frameAddr, module in dombusHub.modules.items():
+        module.statusQueued = False
+        module.lastRx = now
+        module.lastStatus = now
+        module.retry = 0
+        module.nextDue = dbc.TX_DUE_NEVER
+        dombusHub.txSchedule(frameAddr)
+
+
+def sendCost(dombusHub, number):
+    """Return (us for send() with nothing due, us for send() transmitting a command queued for one module)."""
+    quiet(dombusHub)
+    idle = min(timeit.repeat(dombusHub.send, number=number, repeat=3)) / number
+    addrs = list(dombusHub.modules)
+    txQueue = dombusHub.txQueue
+    modules = dombusHub.modules
+    n = [0]
+
+    def sendOne():
+        frameAddr = addrs[n[0] % len(addrs)]
+        n[0] += 1
+        dombusHub.txQueueAddComplete(0, frameAddr, dbc.CMD_SET, 2, 0, 1, (1,), dbc.TX_RETRY)
+        dombusHub.send()
+        txQueue[frameAddr].clear()  # ACK received
+        modules[frameAddr].retry = 0
+
+    tx = min(timeit.repeat(sendOne, number=number, repeat=3)) / number
+    quiet(dombusHub)
+    return idle * 1e6, tx * 1e6
+
+
+def statusDue(dombusHub):
+    """Set the output status of all modules as due."""
+    quiet(dombusHub)
+    for frameAddr, module in dombusHub.modules.items():
+        module.lastStatus = 0
+        module.nextDue = dbc.TX_DUE_NEVER
+    dombusHub.txHeap.clear()
+    for frameAddr in dombusHub.modules:
+        dombusHub.txSchedule(frameAddr)
+
+
+def refreshPass(dombusHub, transport):
+    """Set the output status of all modules as due, and call send() until all have been transmitted: return the results."""
+    statusDue(dombusHub)
+    tx = transport.frames
+    calls = 0
+    start = time.perf_counter()
+    while calls < 100 * len(dombusHub.modules):
+        dombusHub.statusNextTx = 0  # STATUS_TX_INTERVAL elapsed
+        dombusHub.send()
+        calls += 1
+        for queue in dombusHub.txQueue.values():
+            queue.clear()  # ACK received
+        if all(module.lastStatus for module in dombusHub.modules.values()):
+            break
+    elapsed = time.perf_counter() - start
+    quiet(dombusHub)
+    return elapsed, calls, transport.frames - tx
+
+
+def statusPacing(dombusHub, transport):
+    """Set the output status of all modules as due, call send() for PACING_TIME seconds: return (frames, max frames)."""
+    statusDue(dombusHub)
+    tx = transport.frames
+    start = time.time()
+    while time.time() - start < PACING_TIME:
+        dombusHub.send()
+        for queue in dombusHub.txQueue.values():
+            queue.clear()  # ACK received
+    elapsed = time.time() - start
+    quiet(dombusHub)
+    # +1: first status transmitted at start, +1: time.time() truncated to ms by send()
+    return transport.frames - tx, int(elapsed * 1000) // dbc.STATUS_TX_INTERVAL + 2
+
+
+async def runScale(args, modules, configDir):
+    """Run the benchmark with modules x ports entities: return the results."""
+    filename = os.path.join(configDir, dbc.CONFIGFILE)
+    configWrite(filename, modules, args.ports)
+    fileSize = os.path.getsize(filename)
+
+    dombusHub, times = await load(filename, configDir)  # wall time, without tracemalloc
+    entities = len(dombusHub.entities)
+    del dombusHub
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    dombusHub, _ = await load(filename, configDir)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    transport = connect(dombusHub, modules, args.ports)
+    sendIdle, sendTx = sendCost(dombusHub, args.number)
+    heartbeat = min(timeit.repeat(dombusHub.heartbeat, number=args.number, repeat=3)) / args.number
+    refresh, calls, tx = refreshPass(dombusHub, transport)
+    pacingFrames, pacingMax = statusPacing(dombusHub, transport)
+    return {
+        "modules": modules,
+        "entities": entities,
+        "config_bytes": fileSize,
+        "load_ms": round(times["load"] * 1000, 2),
+        "init_ms": round(times["init"] * 1000, 2),
+        "register_ms": round(times["register"] * 1000, 2),
+        "total_ms": round(sum(times.values()) * 1000, 2),
+        "tracemalloc_peak_bytes": peak - base,
+        "bytes_per_entity": round((current - base) / max(1, entities)),
+        "send_idle_us": round(sendIdle, 3),
+        "send_tx_us": round(sendTx, 2),
+        "heartbeat_us": round(heartbeat * 1e6, 2),
+        "refresh_pass_ms": round(refresh * 1000, 2),
+        "refresh_send_calls": calls,
+        "refresh_tx_frames": tx,
+        "pacing_tx_frames": pacingFrames,
+        "pacing_tx_frames_max": pacingMax,
+    }
+
+
+async def run(args):
+    """Run the benchmark for each number of modules: return {modules: result}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as configDir:
+        for modules in args.modules:
+            results[str(modules)] = await runScale(args, modules, configDir)
+    return results
+
+
+def main():
+    """Parse the command line, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--modules",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=[50, 100, 200, 300],
+        help="comma separated list",
+    )
+    parser.add_argument("--ports", type=int, default=dbc.PORTS_MAX)
+    parser.add_argument("--number", type=int, default=1000, help="calls for send() and heartbeat() timings")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    results = asyncio.run(run(args))
+    print(
+        "modules entities  load ms  reg ms total ms  peak MiB  B/entity"
+        "  send idle us  send tx us  heartbeat us  refresh ms (calls)"
+    )
+    for r in results.values():
+        print(
+            f"{r['modules']:7d} {r['entities']:8d} {r['load_ms']:8.1f} {r['register_ms']:7.1f} {r['total_ms']:8.1f}"
+            f" {r['tracemalloc_peak_bytes'] / 1048576:9.1f} {r['bytes_per_entity']:9d}"
+            f" {r['send_idle_us']:13.3f} {r['send_tx_us']:11.2f} {r['heartbeat_us']:13.2f}"
+            f" {r['refresh_pass_ms']:11.1f} ({r['refresh_send_calls']})"
+        )
+    print(f"maxrss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    failed = False
+    for r in results.values():
+        if r["pacing_tx_frames"] > r["pacing_tx_frames_max"]:
+            print(
+                f"FAIL {r['modules']} modules: {r['pacing_tx_frames']} output status frames in {PACING_TIME}s,"
+                f" max {r['pacing_tx_frames_max']} (one every {dbc.STATUS_TX_INTERVAL}ms)"
+            )
+            failed = True
+    if args.save:
+        baseline = {
+            "version": BASELINE_VERSION,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+            "scenarios": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as fd:
+            json.dump(baseline, fd, indent=2)
+            fd.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fd:
+            baseline = json.load(fd)
+        if compare(results, baseline, args.tolerance, METRICS):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Memory benchmark: module state and tx queue records for a bus with 250 modules.
+
+Compares the old records (6-element lists indexed by LAST* / TXQ_* constants, a fresh args list for
+each command) with the ModuleState / TxCommand __slots__ records, measuring with tracemalloc.
+Both layouts use the same containers (modules dict, txQueue dict of dicts keyed by (cmd, port)).
+
+Usage: tools/bench_state_memory.py [--modules 250] [--ports 32]
+"""
+
+import argparse
+import sys
+import time
+import timeit
+import tracemalloc
+
+from dombus_path import dombus
+
+state = dombus("creasol_dombus_state")
+dbc = dombus("creasol_dombus_const")
+
+# indexes of the old list layout of modules[frameAddr]
+LASTTX = 1
+LASTRETRY = 4
+
+
+def buildLists(modules, ports):
+    """Build modules and txQueue with the old list records, in the same txQueue dicts used by the hub."""
+    now = int(time.time())
+    mods = {}
+    txQueue = {}
+    for frameAddr in range(1, modules + 1):
+        mods[frameAddr] = [now, now * 1000, now, 2, 0, 0]
+        txQueue[frameAddr] = {
+            (dbc.CMD_SET, port): [dbc.CMD_SET, 2, 0, port, [1], dbc.TX_RETRY]
+            for port in range(1, ports + 1)
+        }
+    return mods, txQueue
+
+
+def buildSlots(modules, ports):
+    """Build modules and txQueue with ModuleState and TxCommand records, keyed as in the hub."""
+    now = int(time.time())
+    mods = {}
+    txQueue = {}
+    for frameAddr in range(1, modules + 1):
+        mods[frameAddr] = state.ModuleState(now, now * 1000, now, 2)
+        txQueue[frameAddr] = {
+            (dbc.CMD_SET, port): state.TxCommand(
+                dbc.CMD_SET, 2, 0, port, (1,), dbc.TX_RETRY
+            )
+            for port in range(1, ports + 1)
+        }
+    return mods, txQueue
+
+
+def measure(build, modules, ports):
+    """Return (bytes, result) allocated by build()."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(modules, ports)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, default=250)
+    parser.add_argument("--ports", type=int, default=32, help="queued commands per module")
+    args = parser.parse_args()
+
+    print(
+        f"{args.modules} modules, {args.ports} queued commands per module (python {sys.version.split()[0]})"
+    )
+    results = {}
+    for name, build in (("lists", buildLists), ("slots", buildSlots)):
+        size, (mods, txQueue) = measure(build, args.modules, args.ports)
+        modsOnly, _ = measure(build, args.modules, 0)
+        results[name] = size
+        print(
+            f"{name:6s} total={size / 1024:8.1f} KiB  per module={modsOnly / args.modules:6.0f} B"
+            f"  per command={(size - modsOnly) / max(1, args.modules * args.ports):6.0f} B"
+        )
+    print(f"saved: {100 * (1 - results['slots'] / results['lists']):.0f}%")
+
+    # attribute access, as in send()/txDue()
+    mods, _ = buildLists(1, 0)
+    moduleList = mods[1]
+    mods, _ = buildSlots(1, 0)
+    moduleSlots = mods[1]
+    n = 1000000
+    tList = timeit.timeit(
+        lambda: moduleList[LASTTX] + moduleList[LASTRETRY], number=n
+    )
+    tSlots = timeit.timeit(lambda: moduleSlots.lastTx + moduleSlots.retry, number=n)
+    print(
+        f"access lastTx+retry: lists={tList * 1e9 / n:.0f} ns  slots={tSlots * 1e9 / n:.0f} ns"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Read DomBus capture files: print their content, or replay them through DomBusProtocol.decode().
+
+Capture files are written by the capture_start service (creasoldombus_BUSNUM_capture.bin in the
+Home Assistant config dir). Replay feeds the RX records through ReplayTransport, the same transport
+used by the integration with the serial path replay://FILENAME?speed=N, and measures decode():
+parseFrame() only walks the commands of each frame, so results do not depend on Home Assistant.
+
+Usage:
+    tools/dombus_capture.py dump FILE
+    tools/dombus_capture.py replay FILE [--speed 0]   (0=as fast as possible, 1=real time, N=N times faster)
+    tools/dombus_capture.py check   (two writers on the same file: record times read back; exit code 1 on errors)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from dombus_path import dombus
+
+capture = dombus("creasol_dombus_capture")
+codec = dombus("creasol_dombus_codec")
+dbc = dombus("creasol_dombus_const")
+protocol = dombus("creasol_dombus")
+
+
+def dump(filename):
+    """Print the records of the capture file."""
+    for t, direction, data in capture.captureRead(filename):
+        stamp = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))}.{int(t * 1000000) % 1000000:06d}"
+        if direction == capture.CAP_TX:
+            text, _ = codec.frameText(1 if data[0] == dbc.PREAMBLE_MASTER else 2, data, len(data))
+        else:
+            text = bytes(data).hex(" ")  # raw data, as received by the serial port
+        print(f"{stamp} {capture.CAP_NAMES[direction]} {text}")
+
+
+async def replay(filename, speed):
+    """Replay the capture file through DomBusProtocol: return (transport, frames, commands, cpu seconds)."""
+    counters = [0, 0]
+
+    def parseFrame(protocolVersion, frameAddr, dstAddr, payload):
+        counters[0] += 1
+        for _ in codec.iterCommands(protocolVersion, payload):
+            counters[1] += 1
+
+    loop = asyncio.get_running_loop()
+    cpu = time.process_time()
+    transport, _ = await capture.createReplayConnection(
+        loop, lambda: protocol.DomBusProtocol(parseFrame), filename, speed
+    )
+    await transport.finished
+    return transport, counters[0], counters[1], time.process_time() - cpu
+
+
+async def check():
+    """Write records with two CaptureWriter on the same file, as capture_start after a restart: return the errors."""
+    errors = []
+    with tempfile.TemporaryDirectory() as tmpDir:
+        filename = os.path.join(tmpDir, dbc.CAPTUREFILE % 1)
+        written = []  # (unix time, data) of each record
+        for n in range(2):
+            writer = capture.CaptureWriter(filename)
+            for i in range(3):
+                data = bytes((n, i))
+                writer.record(capture.CAP_RX, data)
+                written.append((time.time(), data))
+                await asyncio.sleep(0.05)
+            await writer.close()
+            await asyncio.sleep(0.2)  # pause between the two writers
+        read = []
+        for name in (f"{filename}.1", filename):
+            if os.path.exists(name):
+                read += [(t, bytes(data)) for t, _, data in capture.captureRead(name)]
+        if [data for _, data in read] != [data for _, data in written]:
+            errors.append(f"records read {[d for _, d in read]}, written {[d for _, d in written]}")
+        for (t, data), (tw, _) in zip(read, written):
+            if abs(t - tw) > 0.02:
+                errors.append(f"record {data.hex()}: time {t - tw:+.3f}s")
+    return errors
+
+
+def main():
+    """Parse the command line and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("dump").add_argument("file")
+    p = sub.add_parser("replay")
+    p.add_argument("file")
+    p.add_argument("--speed", type=float, default=0)
+    sub.add_parser("check")
+    args = parser.parse_args()
+    if args.command == "dump":
+        dump(args.file)
+        return
+    if args.command == "check":
+        errors = asyncio.run(check())
+        for error in errors:
+            print(f"FAIL {error}")
+        if errors:
+            sys.exit(1)
+        print("OK: two writers on the same file")
+        return
+    start = time.monotonic()
+    transport, frames, commands, cpu = asyncio.run(replay(args.file, args.speed))
+    elapsed = time.monotonic() - start
+    print(
+        f"{transport.rxRecords} records, {transport.rxBytes} bytes, {frames} frames, {commands} commands"
+        f" in {elapsed:.3f} s (cpu {cpu:.3f} s): {frames / max(cpu, 1e-9):.0f} frames/s of cpu"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Run a DomBus bus without Home Assistant: DomBusHubCore with entities kept in memory by MemorySink.
+
+Modules are discovered and their entities created and updated as in Home Assistant; the state of
+the entities, the rx latency and the command statistics are printed every --interval seconds.
+The serial path can also be a capture file, replay://FILENAME?speed=N (see tools/dombus_capture.py),
+or the pty created by tools/dombus_simulator.py.
+Disabled ports are read from, and written to, --config-dir.
+
+Usage: tools/dombus_headless.py SERIALPATH [--bus 1] [--duration 0] [--interval 10] [--config-dir .]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from dombus_path import dombus
+
+dbc = dombus("creasol_dombus_const")
+hub = dombus("creasol_dombus_hub")
+
+
+def printEntities(dombusHub, sink):
+    """Print the state of the entities in the sink, the rx latency and the command statistics of the hub."""
+    for uniqueID, entity in sorted(sink.entities.items()):
+        print(f"{uniqueID:14s} {entity.platform:13s} {entity.name:30s} {entity.state}")
+    print(f"{len(sink.entities)} entities, {sink.writes} state changes")
+    for stage, summary in dombusHub.rxLatency.summary().items():
+        print(
+            f"rx latency {stage:5s}: {summary['count']} frames,"
+            f" p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms"
+        )
+    for frameAddr, stats in dombusHub.commandStatsSummary().items():
+        print(
+            f"module {frameAddr}: {stats['acked']} commands ACKed, {stats['expired']} expired,"
+            f" {stats['retries_per_command']} retries/command, rtt p50 {stats['rtt']['p50_ms']} ms,"
+            f" time to ACK p50 {stats['time_to_ack']['p50_ms']} ms p95 {stats['time_to_ack']['p95_ms']} ms"
+        )
+
+
+async def run(args):
+    """Connect the hub and print the entities until --duration seconds elapse."""
+    sink = hub.MemorySink()
+    dombusHub = hub.DomBusHubCore(
+        args.bus, sink, serialPath=args.serialpath, configDir=args.config_dir
+    )
+    await dombusHub.portsDisabledInit()
+    dombusHub.rxEnabled = True
+    dombusHub.connect()
+    end = time.monotonic() + args.duration if args.duration > 0 else None
+    try:
+        while end is None or time.monotonic() < end:
+            await asyncio.sleep(args.interval)
+            printEntities(dombusHub, sink)
+    finally:
+        await dombusHub.async_close()
+
+
+def main():
+    """Parse the command line and run the hub."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("serialpath")
+    parser.add_argument("--bus", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=0, help="seconds, 0=forever")
+    parser.add_argument("--interval", type=float, default=10)
+    parser.add_argument("--config-dir", default=".")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Import the Home Assistant independent modules of the creasoldombus component from tools and benchmarks.
+
+The component package __init__.py imports Home Assistant, so the component directory is
+registered as a namespace package named "creasoldombus" without executing it: only the
+modules that do not depend on Home Assistant (codec, const, state, store, ...) can be imported.
+
+Usage:
+    from dombus_path import dombus
+    codec = dombus("creasol_dombus_codec")
+"""
+
+import importlib
+import os
+import sys
+import types
+
+COMPONENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir,
+    "custom_components",
+    "creasoldombus",
+)
+PACKAGE = "creasoldombus"
+
+
+def dombus(name):
+    """Import and return the component module name, e.g. "creasol_dombus_codec"."""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [os.path.normpath(COMPONENT_DIR)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""Virtual DomBus bus: emulate N DomBus modules on a pseudo-terminal, for load tests without hardware.
+
+The simulator opens a pty and prints its path (optionally linked to --link): set it as serial path
+of the integration. Each simulated module, using protocol 2 or protocol 1 (--protocol1 modules):
+- replies to the full port configuration request (CMD_CONFIG port 0xFF) with its port table;
+- transmits the status of its inputs and sensors every --status-interval seconds, and random input
+  changes (--events per second on the whole bus), retransmitting them until ACKed (--retries);
+- ACKs the commands received from the controller (outputs SET, port configuration).
+Frames from modules share a single simulated RS485 bus at 115200 bps, where faults can be injected:
+dropped bytes, wrong checksums, collisions (two frames overlapped), lost controller frames and
+modules that never reply (--silent).
+
+Every --report seconds the simulator prints traffic counters, retransmissions, ACK latency
+(time from the first transmission of a module frame to the ACK from the controller), and the CPU
+used by the simulator and by the process --pid (e.g. Home Assistant).
+
+Usage: tools/dombus_simulator.py [--modules 200] [--ports 30] [--link /tmp/dombus] [--pid PID]
+
+Port names are shortened so that the whole port configuration fits in a single frame (255 bytes payload).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import tty
+
+from dombus_path import dombus
+
+codec = dombus("creasol_dombus_codec")
+dbc = dombus("creasol_dombus_const")
+
+BAUDRATE = 115200
+BYTE_TIME = 10 / BAUDRATE  # seconds to transmit a byte (8N1)
+TURNAROUND_TIME = 0.003  # seconds between the end of a controller frame and the reply of the module
+STATUS_COMMANDS = 8  # max commands in a status frame
+RETRY_TIME = 0.5  # seconds before a module transmits again a frame not ACKed
+PAYLOAD_MAX = 255
+PORT_CHARS = "123456789abcdefghijklmnopqrstuvw"  # single char port names, when longer names do not fit
+
+# port types of simulated modules, repeated to fill --ports ports: (portType, value bytes)
+PORT_MIX = (
+    (dbc.PORTTYPE_OUT_DIGITAL, 1),
+    (dbc.PORTTYPE_OUT_DIGITAL, 1),
+    (dbc.PORTTYPE_IN_DIGITAL, 1),
+    (dbc.PORTTYPE_IN_DIGITAL, 1),
+    (dbc.PORTTYPE_IN_DIGITAL, 1),
+    (dbc.PORTTYPE_SENSOR_TEMP, 2),
+    (dbc.PORTTYPE_SENSOR_HUM, 2),
+    (dbc.PORTTYPE_IN_ANALOG, 2),
+    (dbc.PORTTYPE_OUT_DIMMER, 1),
+    (dbc.PORTTYPE_IN_COUNTER, 1),
+)
+INPUT_TYPES = (
+    dbc.PORTTYPE_IN_DIGITAL,
+    dbc.PORTTYPE_SENSOR_TEMP,
+    dbc.PORTTYPE_SENSOR_HUM,
+    dbc.PORTTYPE_IN_ANALOG,
+    dbc.PORTTYPE_IN_COUNTER,
+)
+
+
+def deviceFrame(protocol, addr, commands):
+    """Return a frame transmitted by module addr: commands is a list of (cmdByte, data bytes after cmd)."""
+    payload = b"".join(bytes((cmdByte,)) + data for cmdByte, data in commands)
+    if protocol == 1:
+        frame = codec.HEADER1.pack(dbc.PREAMBLE_DEVICE, addr, len(payload)) + payload
+    else:
+        frame = codec.HEADER2.pack(dbc.PREAMBLE, 0, addr, len(payload)) + payload
+    return frame + bytes((codec.checksum(frame, 0, len(frame)),))
+
+
+def command(protocol, cmd, cmdAck, port, args):
+    """Return (cmdByte, data) for a command with port and args (bytes)."""
+    cmdLen = 1 + len(args)
+    if protocol == 1:
+        return cmd | cmdAck | cmdLen, bytes((port,)) + args
+    if cmdLen & 1:
+        args += b"\x00"  # protocol 2: even cmdLen
+    return cmd | cmdAck | ((cmdLen + 1) >> 1), bytes((port,)) + args
+
+
+class Module:
+    """Simulated DomBus module."""
+
+    def __init__(self, sim, addr, protocol, ports, silent):
+        """Initialize the module port table and values."""
+        self.sim = sim
+        self.addr = addr
+        self.protocol = protocol
+        self.silent = silent
+        self.ports = [PORT_MIX[(addr + i) % len(PORT_MIX)] for i in range(ports)]
+        self.values = [0] * (ports + 1)  # indexed by port
+        # pending[port]=(value bytes, first transmission time, last transmission time, retries left): status not ACKed yet
+        self.pending = {}
+        self.lastCommands = {}  # lastCommands[port]=(args, time): used to count retransmissions by the controller
+
+    def value(self, port):
+        """Return the value bytes of port, updating sensors."""
+        portType, size = self.ports[port - 1]
+        if portType == dbc.PORTTYPE_SENSOR_TEMP:
+            return int((20 + random.random() * 5 + 273.1) * 10).to_bytes(2, "big")
+        if portType == dbc.PORTTYPE_SENSOR_HUM:
+            return int((40 + random.random() * 20) * 10).to_bytes(2, "big")
+        if portType == dbc.PORTTYPE_IN_ANALOG:
+            return random.randrange(0x10000).to_bytes(2, "big")
+        if portType == dbc.PORTTYPE_IN_COUNTER:
+            return bytes((random.randrange(3),))
+        return self.values[port].to_bytes(size, "big")
+
+    def configReply(self):
+        """Return the reply to CMD_CONFIG port 0xFF: version, then port type, options and name of each port."""
+        if self.protocol == 1:
+            version, record = 1, codec.PORTCONFIG1
+        else:
+            version, record = 2, codec.PORTCONFIG2
+        budget = PAYLOAD_MAX - 3 - len(self.ports) * (record.size + 1)  # cmd, port, version; records and NULs
+        nameLen = max(0, min(codec.PORTNAME_MAX - 1, budget // max(1, len(self.ports))))
+        data = bytearray((version,))
+        for port, (portType, _) in enumerate(self.ports, 1):
+            if self.protocol == 1:
+                data += record.pack(portType & 0xFFFF, dbc.PORTOPT_NONE, 0, 0)
+            else:
+                data += record.pack(portType, dbc.PORTOPT_NONE)
+            name = f"IO{port}"
+            if len(name) > nameLen:
+                # shorter names: "12", then a single char (1..9, a..w), then no name
+                name = f"{port}" if len(f"{port}") <= nameLen else PORT_CHARS[port - 1 : port] if nameLen else ""
+            data += name.encode() + b"\x00"
+        # long reply: the length field in the cmd byte is ignored
+        return dbc.CMD_CONFIG | dbc.CMD_ACK, b"\xff" + bytes(data)
+
+    def receive(self, commands):
+        """Handle the commands received from the controller: return the list of reply commands."""
+        replies = []
+        now = time.monotonic()
+        stats = self.sim.stats
+        for cmd in commands:
+            if cmd.ack:
+                # ACK of a status transmitted by this module
+                stats["rxAck"] += 1
+                pending = self.pending.pop(cmd.port, None)
+                if pending is not None:
+                    self.sim.latency.append(now - pending[1])
+            elif cmd.cmd == dbc.CMD_CONFIG:
+                stats["rxConfig"] += 1
+                if cmd.port == 0xFF:
+                    replies.append(self.configReply())
+                else:
+                    replies.append(command(self.protocol, dbc.CMD_CONFIG, dbc.CMD_ACK, cmd.port, bytes(cmd.args)))
+            elif cmd.cmd == dbc.CMD_SET and 1 <= cmd.port <= len(self.ports):
+                stats["rxSet"] += 1
+                args = bytes(cmd.args)
+                last = self.lastCommands.get(cmd.port)
+                if last is not None and last[0] == args and now - last[1] < 2:
+                    stats["rxSetRetry"] += 1  # same command again: the previous ACK was lost or too late
+                self.lastCommands[cmd.port] = (args, now)
+                if args:
+                    self.values[cmd.port] = args[0]
+                replies.append(command(self.protocol, dbc.CMD_SET, dbc.CMD_ACK, cmd.port, args[:2]))
+            elif cmd.cmd == dbc.CMD_GET:
+                replies.append(command(self.protocol, dbc.CMD_GET, dbc.CMD_ACK, cmd.port, b""))
+        return replies
+
+    def status(self, ports):
+        """Queue frames with the status of ports (inputs and sensors), to be retransmitted until ACKed."""
+        now = time.monotonic()
+        commands = []
+        for port in ports:
+            value = self.value(port)
+            self.pending[port] = (value, now, now, self.sim.args.retries)
+            commands.append(command(self.protocol, dbc.CMD_SET, 0, port, value))
+        for i in range(0, len(commands), STATUS_COMMANDS):
+            self.sim.busWrite(deviceFrame(self.protocol, self.addr, commands[i : i + STATUS_COMMANDS]))
+
+    def retransmit(self):
+        """Transmit again the status not ACKed within RETRY_TIME since its last transmission."""
+        now = time.monotonic()
+        commands = []
+        for port, (value, first, sent, retries) in list(self.pending.items()):
+            if now - sent < RETRY_TIME:
+                continue
+            if retries <= 0:
+                del self.pending[port]
+                self.sim.stats["unacked"] += 1
+                continue
+            self.pending[port] = (value, first, now, retries - 1)
+            commands.append(command(self.protocol, dbc.CMD_SET, 0, port, value))
+        if commands:
+            self.sim.stats["retransmit"] += len(commands)
+            for i in range(0, len(commands), STATUS_COMMANDS):
+                self.sim.busWrite(deviceFrame(self.protocol, self.addr, commands[i : i + STATUS_COMMANDS]))
+
+    def inputs(self):
+        """Return the list of input and sensor ports."""
+        return [port for port, (portType, _) in enumerate(self.ports, 1) if portType in INPUT_TYPES]
+
+
+class Simulator:
+    """Pseudo-terminal with the simulated bus."""
+
+    def __init__(self, args):
+        """Create the modules and the pty."""
+        self.args = args
+        self.loop = asyncio.get_running_loop()
+        self.stats = dict.fromkeys(
+            (
+                "rxFrames", "rxBytes", "rxErrors", "rxConfig", "rxSet", "rxSetRetry", "rxAck",
+                "txFrames", "txBytes", "retransmit", "unacked", "faultDrop", "faultChecksum",
+                "faultCollision", "faultLost", "overrun",
+            ),
+            0,
+        )
+        self.latency = []  # ACK latency of each status, reset at each report
+        self.modules = {}
+        silent = set(random.sample(range(args.modules), min(args.silent, args.modules)))
+        for i in range(args.modules):
+            addr = args.address + i
+            protocol = 1 if i < args.protocol1 else 2
+            self.modules[addr] = Module(self, addr, protocol, args.ports, i in silent)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # no echo, no line discipline
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        self.rxbuffer = bytearray()
+        self.bus = []  # frames waiting to be transmitted on the bus
+        self.busWakeup = asyncio.Event()
+
+    def busWrite(self, frame):
+        """Queue a frame transmitted by a module."""
+        self.bus.append(frame)
+        self.busWakeup.set()
+
+    async def busTask(self):
+        """Transmit the queued frames to the pty at the bus speed, injecting faults."""
+        args = self.args
+        while True:
+            await self.busWakeup.wait()
+            self.busWakeup.clear()
+            while self.bus:
+                frame = bytearray(self.bus.pop(0))
+                if self.bus and random.random() < args.collision:
+                    # two modules transmitting together: the receiver gets a mix of both frames
+                    other = self.bus.pop(0)
+                    for i in range(min(len(frame), len(other))):
+                        frame[i] &= other[i]  # RS485: dominant 0
+                    self.stats["faultCollision"] += 1
+                if random.random() < args.bad_checksum:
+                    frame[-1] ^= 0x55
+                    self.stats["faultChecksum"] += 1
+                if random.random() < args.drop:
+                    del frame[random.randrange(len(frame))]
+                    self.stats["faultDrop"] += 1
+                try:
+                    os.write(self.master, frame)
+                except BlockingIOError:
+                    self.stats["overrun"] += 1  # nobody is reading the pty
+                self.stats["txFrames"] += 1
+                self.stats["txBytes"] += len(frame)
+                await asyncio.sleep(len(frame) * BYTE_TIME)
+
+    def onRead(self):
+        """Read frames transmitted by the controller."""
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self.rxbuffer += data
+        self.stats["rxBytes"] += len(data)
+        self.decode()
+
+    def decode(self):
+        """Decode the controller frames in rxbuffer: PREAMBLE_MASTER (protocol 1) or PREAMBLE (protocol 2)."""
+        buf = self.rxbuffer
+        idx = 0
+        while len(buf) - idx >= dbc.FRAME_LEN_MIN:
+            if buf[idx] == dbc.PREAMBLE_MASTER:
+                protocol, headerLen = 1, dbc.FRAME_HEADER
+                frameLen = buf[idx + dbc.FRAME_LEN] + dbc.FRAME_HEADER + 1
+            elif buf[idx] == dbc.PREAMBLE:
+                protocol, headerLen = 2, dbc.FRAME_HEADER2
+                if len(buf) - idx < dbc.FRAME_LEN_MIN2:
+                    break
+                frameLen = buf[idx + dbc.FRAME_LEN2] + dbc.FRAME_HEADER2 + 1
+            else:
+                idx += 1
+                continue
+            if len(buf) - idx < frameLen:
+                break
+            if codec.checksum(buf, idx, frameLen - 1) != buf[idx + frameLen - 1]:
+                self.stats["rxErrors"] += 1
+                idx += 1
+                continue
+            if protocol == 1:
+                (_, addr, _) = codec.HEADER1.unpack_from(buf, idx)
+            else:
+                (_, addr, _, _) = codec.HEADER2.unpack_from(buf, idx)
+            payload = bytes(buf[idx + headerLen : idx + frameLen - 1])
+            idx += frameLen
+            self.stats["rxFrames"] += 1
+            module = self.modules.get(addr)
+            if module is None or module.silent:
+                continue
+            if random.random() < self.args.lost:
+                self.stats["faultLost"] += 1  # frame not received by the module
+                continue
+            replies = module.receive(list(codec.iterCommands(protocol, payload)))
+            if replies:
+                frame = deviceFrame(module.protocol, addr, replies)
+                self.loop.call_later(TURNAROUND_TIME, self.busWrite, frame)
+        del buf[0:idx]
+
+    async def statusTask(self):
+        """Transmit periodic status, random input changes and retransmissions."""
+        args = self.args
+        active = [m for m in self.modules.values() if not m.silent]
+        inputs = {m.addr: m.inputs() for m in active}
+        tick = 0.05
+        nextStatus = {m.addr: random.random() * args.status_interval for m in active}
+        start = time.monotonic()
+        while True:
+            await asyncio.sleep(tick)
+            elapsed = time.monotonic() - start
+            for module in active:
+                if elapsed >= nextStatus[module.addr]:
+                    nextStatus[module.addr] += args.status_interval
+                    module.status(inputs[module.addr])
+            for _ in range(self.events(tick)):
+                module = random.choice(active)
+                digital = [p for p in inputs[module.addr] if module.ports[p - 1][0] == dbc.PORTTYPE_IN_DIGITAL]
+                if digital:
+                    port = random.choice(digital)
+                    module.values[port] ^= 1
+                    module.status((port,))
+            for module in active:
+                if module.pending:
+                    module.retransmit()  # only the status transmitted at least RETRY_TIME ago
+
+    def events(self, interval):
+        """Return the number of random input changes in interval seconds (Poisson distribution)."""
+        rate = self.args.events * interval
+        n = 0
+        t = random.expovariate(1) if rate > 0 else 1
+        while rate > 0 and t < rate:
+            n += 1
+            t += random.expovariate(1)
+        return n
+
+    async def reportTask(self):
+        """Print statistics every --report seconds."""
+        args = self.args
+        last = dict(self.stats)
+        lastTime = time.monotonic()
+        lastCpu = time.process_time()
+        lastPidCpu = pidCpu(args.pid)
+        while True:
+            await asyncio.sleep(args.report)
+            now = time.monotonic()
+            cpu = time.process_time()
+            interval = now - lastTime
+            delta = {k: v - last[k] for k, v in self.stats.items()}
+            line = (
+                f"rx {delta['rxFrames'] / interval:6.1f} fr/s (cfg {delta['rxConfig']}, set {delta['rxSet']},"
+                f" set again {delta['rxSetRetry']}, ack {delta['rxAck']}, err {delta['rxErrors']})"
+                f"  tx {delta['txFrames'] / interval:6.1f} fr/s {100 * delta['txBytes'] * BYTE_TIME / interval:3.0f}% bus"
+                f"  retransmit {delta['retransmit']} unacked {delta['unacked']}"
+            )
+            if len(self.latency) >= 2:
+                q = statistics.quantiles(self.latency, n=100)
+                line += f"  ack ms p50={q[49] * 1000:.0f} p95={q[94] * 1000:.0f} p99={q[98] * 1000:.0f}"
+            line += f"  cpu sim={100 * (cpu - lastCpu) / interval:.0f}%"
+            pidCpuNow = pidCpu(args.pid)
+            if pidCpuNow is not None and lastPidCpu is not None:
+                line += f" pid={100 * (pidCpuNow - lastPidCpu) / interval:.0f}%"
+            faults = sum(delta[k] for k in ("faultDrop", "faultChecksum", "faultCollision", "faultLost"))
+            if faults:
+                line += f"  faults {faults}"
+            print(line, flush=True)
+            self.latency.clear()
+            last = dict(self.stats)
+            lastTime, lastCpu, lastPidCpu = now, cpu, pidCpuNow
+
+    def close(self):
+        """Close the pty."""
+        self.loop.remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def pidCpu(pid):
+    """Return the cpu seconds (user+system) used by process pid, or None."""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as fd:
+            fields = fd.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def run(args):
+    """Run the simulator for --duration seconds (0=forever)."""
+    sim = Simulator(args)
+    print(
+        f"{args.modules} modules ({args.protocol1} with protocol 1, {min(args.silent, args.modules)} silent),"
+        f" {args.modules * args.ports} ports on {sim.path}",
+        flush=True,
+    )
+    if args.link:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(sim.path, args.link)
+    sim.loop.add_reader(sim.master, sim.onRead)
+    tasks = [asyncio.create_task(t) for t in (sim.busTask(), sim.statusTask(), sim.reportTask())]
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        sim.close()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+    print(" ".join(f"{k}={v}" for k, v in sim.stats.items()))
+
+
+def main():
+    """Parse the command line and run the simulator."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, default=200)
+    parser.add_argument("--ports", type=int, default=30, help="ports per module (max 32)")
+    parser.add_argument("--protocol1", type=int, default=0, help="number of modules using protocol 1")
+    parser.add_argument("--address", type=lambda x: int(x, 16), default=0x0101, help="first module address (hex)")
+    parser.add_argument("--status-interval", type=float, default=60, help="seconds between status frames of a module")
+    parser.add_argument("--events", type=float, default=5, help="random input changes per second on the bus")
+    parser.add_argument("--retries", type=int, default=3, help="retransmissions of a status not ACKed")
+    parser.add_argument("--drop", type=float, default=0, help="probability of dropping a byte from a frame")
+    parser.add_argument("--bad-checksum", type=float, default=0, help="probability of a wrong checksum")
+    parser.add_argument("--collision", type=float, default=0, help="probability of a collision between two frames")
+    parser.add_argument("--lost", type=float, default=0, help="probability that a controller frame is not received")
+    parser.add_argument("--silent", type=int, default=0, help="number of modules that never reply")
+    parser.add_argument("--report", type=float, default=10, help="seconds between statistics")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run (0=forever)")
+    parser.add_argument("--link", help="create a symlink to the pty, e.g. /tmp/dombus")
+    parser.add_argument("--pid", type=int, help="process (e.g. Home Assistant) whose cpu usage is reported")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible runs")
+    args = parser.parse_args()
+    args.ports = max(1, min(args.ports, dbc.PORTS_MAX))
+    if args.seed is not None:
+        random.seed(args.seed)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()